@@ -0,0 +1,26 @@
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+
+# Redis в продакшене, локальная память процесса для разработки и тестов.
+# Версия каталога в локальной памяти меняется только в процессе, который сохранил изменение,
+# остальные воркеры uWSGI отдавали бы устаревшие ответы и валидаторы.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_URL'),
+        }
+    }
+elif not DEBUG:  # noqa: F821 - объявлен в settings.py до include()
+    raise ImproperlyConfigured('REDIS_URL must be set when DEBUG is off, the API cache has to be shared by all workers')
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Сколько секунд хранятся ответы API и их валидаторы, изменения через ORM сбрасывают кэш сразу.
+MOVIES_CACHE_TIMEOUT = int(os.environ.get('MOVIES_CACHE_TIMEOUT', 300))
@@ -93,6 +93,7 @@ WSGI_APPLICATION = 'config.wsgi.application'
 
 include(
     'components/database.py',
+    'components/cache.py',
 )
 
 
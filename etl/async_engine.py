@@ -0,0 +1,249 @@
+"""ETL engine on asyncio, selected with ETL_ENGINE=async
+
+Enrich queries run over an asyncpg pool and bulk requests over
+AsyncElasticsearch, up to ENRICH_WORKERS batches at a time. The SQL and the
+document builders are shared with the threaded engine, so both produce the
+same documents and keep state in the same format. Changes are found by
+polling modified columns. Notify mode, partial updates, validated documents
+and distributed mode are served by the threaded engine only, the ETL refuses
+to start with them and ETL_ENGINE=async.
+"""
+import asyncio
+from datetime import datetime, timezone
+from time import perf_counter
+from typing import Optional
+
+import asyncpg
+import backoff
+import orjson
+from elasticsearch import AsyncElasticsearch, ConnectionError, ConnectionTimeout
+from elasticsearch.helpers import async_streaming_bulk
+
+import config
+import metrics
+from sql import SQL
+from db import numbered_params
+from logger import logger
+from fingerprints import FingerprintCache, fingerprint
+from loader import CONFLICT_STATUS, IGNORE_STATUSES, RETRY_STATUSES
+from state.models import State
+from extract import DOCUMENT_BUILDERS, Enricher, get_cursor
+
+# errors after which the cycle is started again from the saved positions,
+# elasticsearch connection errors are transport errors rather than OSError
+RETRY_ERRORS = (asyncpg.PostgresConnectionError, asyncpg.InterfaceError, OSError, ConnectionError, ConnectionTimeout)
+
+
+async def _init_connection(conn: asyncpg.Connection) -> None:
+    # the same types psycopg2 returns, so documents and states do not depend on the engine
+    await conn.set_type_codec('uuid', encoder=str, decoder=str, schema='pg_catalog', format='text')
+    for json_type in ('json', 'jsonb'):
+        await conn.set_type_codec(json_type, encoder=lambda value: orjson.dumps(value).decode(),
+                                  decoder=orjson.loads, schema='pg_catalog')
+
+
+def _timestamp(value: str) -> datetime:
+    """asyncpg takes datetimes only, states keep str(datetime)"""
+    moment = datetime.fromisoformat(value)
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+
+class AsyncEngine:
+    """ Poll sources for changes and load them with many queries and requests in flight """
+
+    def __init__(self,
+                 pool: asyncpg.Pool,
+                 es: AsyncElasticsearch,
+                 sources: list[tuple[str, str, State]],
+                 fingerprints: Optional[FingerprintCache] = None):
+        self.pool = pool
+        self.es = es
+        self.sources = sources
+        self.fingerprints = fingerprints
+        self.slots = asyncio.Semaphore(config.ENRICH_WORKERS)
+        self.positions = {
+            (index, table_name): get_cursor(state, table_name) for index, table_name, state in sources
+        }
+
+    async def run_cycle(self) -> None:
+        await self.pool.execute(SQL.purge_changes())
+        await self.run_tombstone_cycle()
+        for index in dict.fromkeys(index for index, _, _ in self.sources):
+            while await self._run_round(index):
+                pass
+        metrics.CYCLE.set_to_current_time()
+
+    async def run_tombstone_cycle(self) -> None:
+        """Delete documents of removed rows, then the tombstones themselves"""
+        indices = {table_name for index, table_name, _ in self.sources if index == table_name}
+        while rows := await self.pool.fetch(numbered_params(SQL.select_tombstones(), 2), 0, config.BATCH_SIZE):
+            actions = [
+                {'_op_type': 'delete', '_index': table_name, '_id': row_id,
+                 'version': version, 'version_type': 'external_gte'}
+                for _, table_name, row_id, version in rows if table_name in indices
+            ]
+            logger.info('Deleting %s documents', len(actions))
+            await self._bulk(actions)
+            if self.fingerprints:
+                for index in indices:
+                    self.fingerprints.forget(index, [action['_id'] for action in actions if action['_index'] == index])
+            await self.pool.execute(numbered_params(SQL.delete_tombstones(), 1), [row[0] for row in rows])
+
+    async def _run_round(self, index: str) -> bool:
+        """Load at most CYCLE_MAX_IDS changed documents of an index, return whether more are left"""
+        dirty = set()
+        positions = {}
+        started = perf_counter()
+        for index_name, table_name, state in self.sources:
+            if index_name != index:
+                continue
+            key = (index, table_name)
+            position = self.positions[key]
+            while rows := await self.pool.fetch(
+                numbered_params(SQL.select_modified_ids(table_name, limit=config.BATCH_SIZE), 2),
+                _timestamp(position['modified']), position['id'],
+            ):
+                ids = [row[0] for row in rows]
+                position = {'modified': str(rows[-1][1]), 'id': rows[-1][0]}
+                positions[key] = (state, table_name, position)
+                if index == table_name:
+                    dirty.update(ids)
+                else:
+                    film_work_ids = await self.pool.fetch(numbered_params(SQL.select_film_works_from(table_name), 1), ids)
+                    dirty.update(row[0] for row in film_work_ids)
+                if len(dirty) >= config.CYCLE_MAX_IDS:
+                    break
+            else:
+                metrics.observe_caught_up(index, table_name, position)
+            if len(dirty) >= config.CYCLE_MAX_IDS:
+                break
+        metrics.STAGE_SECONDS.labels('extract').observe(perf_counter() - started)
+        if not positions:
+            return False
+
+        ids = list(dirty)
+        await asyncio.gather(*(
+            self._load_batch(index, ids[start:start + config.BATCH_SIZE])
+            for start in range(0, len(ids), config.BATCH_SIZE)
+        ))
+
+        # every batch of the round is loaded, so its positions are safe to save
+        states = {}
+        for key, (state, table_name, position) in positions.items():
+            state.set_state(table_name, position)
+            metrics.observe_watermark(index, table_name, position)
+            self.positions[key] = position
+            states[id(state)] = state
+        await asyncio.gather(*(asyncio.to_thread(state.flush) for state in states.values()))
+        return len(dirty) >= config.CYCLE_MAX_IDS
+
+    async def _load_batch(self, index: str, ids: list) -> None:
+        async with self.slots:
+            started = perf_counter()
+            rows = await self.pool.fetch(numbered_params(Enricher.SQL[index](), 1), ids)
+            metrics.STAGE_SECONDS.labels('enrich').observe(perf_counter() - started)
+            metrics.ROWS.labels(index).inc(len(rows))
+
+            started = perf_counter()
+            documents = list(DOCUMENT_BUILDERS[index](rows))
+            metrics.STAGE_SECONDS.labels('transform').observe(perf_counter() - started)
+
+            digests = {}
+            if self.fingerprints:
+                digests = {document.uuid: fingerprint(document.source) for document in documents}
+                unchanged = self.fingerprints.unchanged(index, digests)
+                documents = [document for document in documents if document.uuid not in unchanged]
+                metrics.SKIPPED_DOCUMENTS.labels(index).inc(len(unchanged))
+
+            started = perf_counter()
+            dropped = await self._bulk([
+                {'_index': index, '_id': document.uuid, '_source': document.source,
+                 'version': document.version, 'version_type': 'external_gte'}
+                for document in documents
+            ])
+            metrics.STAGE_SECONDS.labels('load').observe(perf_counter() - started)
+            if self.fingerprints:
+                self.fingerprints.remember(index, {
+                    document.uuid: digests[document.uuid] for document in documents if document.uuid not in dropped
+                })
+
+    async def _bulk(self, actions: list[dict]) -> set[str]:
+        """Send actions until none fails temporarily, return ids failed for good or skipped as stale
+
+        Positions and tombstones are saved only after this returns, so
+        temporary failures are sent again rather than dropped.
+        """
+        dropped = set()
+        for action in actions:
+            metrics.DOCUMENTS.labels(action['_index'], action.get('_op_type', 'index')).inc()
+        attempt = 0
+        while actions:
+            by_id = {(action.get('_op_type', 'index'), str(action['_id'])): action for action in actions}
+            failed = []
+            async for ok, item in async_streaming_bulk(
+                self.es, actions,
+                chunk_size=config.BULK_CHUNK_SIZE,
+                max_chunk_bytes=config.BULK_MAX_CHUNK_BYTES,
+                max_retries=5,
+                initial_backoff=config.BULK_RETRY_BACKOFF,
+                raise_on_error=False,
+                raise_on_exception=False,
+                ignore_status=IGNORE_STATUSES,
+                yield_ok=False,
+            ):
+                op_type, info = item.popitem()
+                status = info.get('status')
+                if status in IGNORE_STATUSES:
+                    continue
+                if status == CONFLICT_STATUS:
+                    metrics.STALE_DOCUMENTS.labels(info.get('_index')).inc()
+                    dropped.add(info.get('_id'))
+                    continue
+                if status == 429:
+                    metrics.BULK_REJECTED.inc()
+                if status in RETRY_STATUSES:
+                    failed.append(by_id[(op_type, str(info['_id']))])
+                    continue
+                metrics.BULK_FAILED.inc()
+                dropped.add(info.get('_id'))
+                logger.error('Failed to %s document %s in %s: %s',
+                             op_type, info.get('_id'), info.get('_index'), info.get('error'))
+            metrics.BULK_RETRIED.inc(len(failed))
+            if failed:
+                logger.warning('%s of %s actions failed, retrying them', len(failed), len(actions))
+                await asyncio.sleep(min(config.BULK_RETRY_BACKOFF * 2 ** attempt, 60))
+                attempt += 1
+            actions = failed
+        return dropped
+
+
+@backoff.on_exception(backoff.expo,
+                      RETRY_ERRORS,
+                      logger=logger)
+async def create_pool() -> asyncpg.Pool:
+    dsn = config.DSN
+    return await asyncpg.create_pool(
+        host=dsn['host'], port=dsn['port'], user=dsn['user'], password=dsn['password'], database=dsn['dbname'],
+        server_settings={'search_path': 'content'},
+        min_size=1, max_size=config.ENRICH_WORKERS + 1,
+        init=_init_connection,
+    )
+
+
+async def run(sources: list[tuple[str, str, State]]) -> None:
+    pool = await create_pool()
+    es = AsyncElasticsearch(config.ELASTIC_URL)
+    fingerprints = FingerprintCache(config.FINGERPRINT_CACHE) if config.FINGERPRINT_CACHE else None
+    engine = AsyncEngine(pool, es, sources, fingerprints)
+
+    attempt = 0
+    while True:
+        try:
+            await engine.run_cycle()
+            attempt = 0
+            await asyncio.sleep(config.ITER_PAUSE_TIME)
+        except RETRY_ERRORS:
+            # positions move only after a round is loaded, the cycle starts over from them
+            logger.exception('ETL cycle failed, retrying')
+            await asyncio.sleep(min(2 ** attempt, 60))
+            attempt += 1
@@ -0,0 +1,118 @@
+"""Initial load of all indices by several processes
+
+The id space of every table is split into equal UUID ranges, one per
+process. Each process has its own Postgres connection, Elasticsearch client
+and pipeline and saves its position per table, so a crashed backfill resumes
+where its shards stopped when started again with the same number of workers.
+Once every shard is done, incremental watermarks are set to the time the
+backfill started.
+"""
+import multiprocessing
+from contextlib import closing
+
+import backoff
+from elasticsearch import Elasticsearch
+
+import config
+from sql import SQL
+from db import CONNECTION_ERRORS, connect, database_now, execute_prepared
+from logger import logger
+from pipeline import Batch, Pipeline
+from state.models import State
+from extract import (
+    INDICES, TABLE_NAMES, FILM_WORK_TABLE_NAME, MIN_UUID, build_pipeline, get_storage,
+)
+
+MAX_UUID = 'ffffffff-ffff-ffff-ffff-ffffffffffff'
+
+# every index is built from the ids of its own table
+SOURCES = [(index, index) for index in INDICES.values()]
+
+
+class BackfillError(Exception):
+    """Raised when some shards failed, the backfill may be started again to resume them"""
+
+
+def _uuid(number: int) -> str:
+    digits = f'{number:032x}'
+    return f'{digits[:8]}-{digits[8:12]}-{digits[12:16]}-{digits[16:20]}-{digits[20:]}'
+
+
+def shard_bounds(workers: int) -> list[tuple[str, str]]:
+    """Split the UUID space into (after, up to) ranges, the nil UUID itself is never generated"""
+    bounds = [_uuid(shard * 2 ** 128 // workers) for shard in range(workers)] + [MAX_UUID]
+    return list(zip(bounds, bounds[1:]))
+
+
+@backoff.on_exception(backoff.expo,
+                      CONNECTION_ERRORS,
+                      logger=logger)
+def copy_shard(pipeline: Pipeline, state: State, positions: dict, upto: str, started: str) -> None:
+    """Submit ids of every table from the shard positions up to the end of the shard"""
+    with closing(connect()) as conn:
+        for index, table_name in SOURCES:
+            while True:
+                with conn, conn.cursor() as cursor:
+                    execute_prepared(cursor, f'select_ids_between_{table_name}',
+                                     SQL.select_ids_between(table_name, limit=config.BATCH_SIZE),
+                                     (positions[table_name], upto))
+                    ids = [result[0] for result in cursor.fetchall()]
+                if not ids:
+                    break
+                position = {'started': started, 'id': ids[-1]}
+                pipeline.submit(Batch(index, ids, [(state, table_name, position)]))
+                positions[table_name] = ids[-1]
+
+
+def run_shard(shard: int, workers: int, started: str) -> None:
+    after, upto = shard_bounds(workers)[shard]
+    state = State(get_storage(f'backfill_{shard}_of_{workers}_state'))
+    positions = {}
+    for _, table_name in SOURCES:
+        saved = state.get_state(table_name)
+        # positions of an earlier, finished backfill are not resumed
+        positions[table_name] = saved['id'] if isinstance(saved, dict) and saved.get('started') == started else after
+
+    logger.info('Backfilling shard %s of %s: ids after %s up to %s', shard + 1, workers, positions, upto)
+    pipeline = build_pipeline(Elasticsearch(config.ELASTIC_URL))
+    pipeline.start()
+    copy_shard(pipeline, state, positions, upto, started)
+    pipeline.stop()
+    logger.info('Shard %s of %s is loaded', shard + 1, workers)
+
+
+def backfill(workers: int, states: dict[str, State]) -> None:
+    """Load all rows by `workers` processes and move watermarks of the given {index: state} past them"""
+    backfill_state = State(get_storage('backfill_state'))
+    run = backfill_state.get_state('run')
+    if isinstance(run, dict) and not run['finished'] and run['workers'] == workers:
+        started = run['started']
+        logger.info('Resuming backfill started at %s', started)
+    else:
+        started = database_now()
+        backfill_state.set_state('run', {'started': started, 'workers': workers, 'finished': False})
+        backfill_state.flush()
+        logger.info('Starting backfill at %s with %s workers', started, workers)
+
+    # fresh interpreters, so no Postgres connection or thread is inherited
+    context = multiprocessing.get_context('spawn')
+    processes = [
+        context.Process(target=run_shard, args=(shard, workers, started), name=f'backfill-{shard}')
+        for shard in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    failed = [process.name for process in processes if process.exitcode != 0]
+    if failed:
+        raise BackfillError(f'Backfill shards failed: {", ".join(failed)}')
+
+    # rows changed while the backfill was running are picked up incrementally
+    for index, state in states.items():
+        for table_name in (TABLE_NAMES if index == FILM_WORK_TABLE_NAME else (index,)):
+            state.set_state(table_name, {'modified': started, 'id': MIN_UUID})
+        state.flush()
+    backfill_state.set_state('run', {'started': started, 'workers': workers, 'finished': True})
+    backfill_state.flush()
+    logger.info('Backfill started at %s is finished', started)
@@ -0,0 +1,288 @@
+"""Measure ETL throughput on a synthetic catalog
+
+    python benchmark.py --generate --films 100000 --persons 20000 --genres 30 [--seed 1]
+    python benchmark.py [--index film_work] [--elastic http://localhost:9200] [--output report.json]
+    python benchmark.py --explain [--output plans.json]
+
+--generate fills the content tables with deterministic rows (ids are derived
+from the seed and row number, so generating twice adds nothing). Row
+triggers are bypassed through session_replication_role, which needs a
+superuser, so run it against a local database only.
+
+The run loads every index once through the full pipeline into throwaway
+indices of a local Elasticsearch, or by default into a stub bulk endpoint
+answering every action with success, and prints a JSON report with rows
+per second, peak RSS and time spent by every stage.
+
+--explain runs the polling, fan-out and enrich queries of the ETL under
+EXPLAIN ANALYZE for the latest rows and reports the scans of every plan, so
+running it before and after a migration shows which indexes are used.
+"""
+import argparse
+import json
+import platform
+import resource
+import threading
+from contextlib import closing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter
+from typing import Iterator, Optional
+
+from elasticsearch import Elasticsearch
+from prometheus_client import REGISTRY
+
+import config
+from sql import SQL
+from db import connect
+from logger import logger
+from es_index import get_index
+from indices import BULK_LOAD_SETTINGS
+from extract import INDICES, Extractor, build_pipeline
+from state.models import State
+from state.memory_storage import MemoryStorage
+
+CLASS_NAMES = {alias: class_name for class_name, alias in INDICES.items()}
+STAGES = ('extract', 'enrich', 'transform', 'load', 'commit')
+
+GENERATE_SQL = {
+    'genre': """INSERT INTO content.genre (id, name, description, created, modified)
+                SELECT md5(%(seed)s || '-genre-' || n)::uuid, 'Genre ' || n, md5(random()::text), now(), now()
+                FROM generate_series(%(start)s, %(stop)s) n
+                ON CONFLICT DO NOTHING;""",
+    'person': """INSERT INTO content.person (id, full_name, created, modified)
+                 SELECT md5(%(seed)s || '-person-' || n)::uuid, 'Person ' || n, now(), now()
+                 FROM generate_series(%(start)s, %(stop)s) n
+                 ON CONFLICT DO NOTHING;""",
+    'film_work': """INSERT INTO content.film_work (id, title, description, creation_date, rating, type, created, modified)
+                    SELECT md5(%(seed)s || '-film_work-' || n)::uuid,
+                           'Film ' || n,
+                           repeat(md5(random()::text), 1 + (random() * 8)::int),
+                           date '1920-01-01' + (random() * 37000)::int,
+                           round((random() * 10)::numeric, 1),
+                           CASE WHEN random() < 0.8 THEN 'movie' ELSE 'tv_show' END,
+                           now(), now()
+                    FROM generate_series(%(start)s, %(stop)s) n
+                    ON CONFLICT DO NOTHING;""",
+    # a few persons and genres are much more popular than the rest, like in real catalogs
+    'person_film_work': """INSERT INTO content.person_film_work (id, film_work_id, person_id, role, created)
+                           SELECT md5(%(seed)s || '-person_film_work-' || n || '-' || k)::uuid,
+                                  md5(%(seed)s || '-film_work-' || n)::uuid,
+                                  md5(%(seed)s || '-person-' || (1 + floor(power(random(), 3) * %(persons)s)::int))::uuid,
+                                  CASE WHEN k = 1 THEN 'director' WHEN random() < 0.8 THEN 'actor' ELSE 'writer' END,
+                                  now()
+                           FROM generate_series(%(start)s, %(stop)s) n, generate_series(1, %(persons_per_film)s) k
+                           ON CONFLICT DO NOTHING;""",
+    'genre_film_work': """INSERT INTO content.genre_film_work (id, film_work_id, genre_id, created)
+                          SELECT md5(%(seed)s || '-genre_film_work-' || n || '-' || k)::uuid,
+                                 md5(%(seed)s || '-film_work-' || n)::uuid,
+                                 md5(%(seed)s || '-genre-' || (1 + floor(power(random(), 2) * %(genres)s)::int))::uuid,
+                                 now()
+                          FROM generate_series(%(start)s, %(stop)s) n, generate_series(1, %(genres_per_film)s) k
+                          ON CONFLICT DO NOTHING;""",
+}
+
+
+def generate(args: argparse.Namespace) -> None:
+    """Insert the synthetic catalog chunk by chunk"""
+    counts = {
+        'genre': args.genres,
+        'person': args.persons,
+        'film_work': args.films,
+        'person_film_work': args.films,
+        'genre_film_work': args.films,
+    }
+    with closing(connect()) as conn:
+        for table_name, count in counts.items():
+            started = perf_counter()
+            for start in range(1, count + 1, args.chunk):
+                with conn, conn.cursor() as cursor:
+                    # skip ETL triggers, nothing is synced while generating
+                    cursor.execute('SET LOCAL session_replication_role = replica;')
+                    cursor.execute('SELECT setseed(%s);', (1 / (1 + args.seed + start),))
+                    cursor.execute(GENERATE_SQL[table_name], {
+                        **vars(args), 'seed': str(args.seed), 'start': start, 'stop': min(start + args.chunk - 1, count),
+                    })
+            logger.info('Generated %s rows for %s in %.1fs', count, table_name, perf_counter() - started)
+
+
+class StubBulkHandler(BaseHTTPRequestHandler):
+    """ Answers like an Elasticsearch node accepting every bulk action """
+
+    protocol_version = 'HTTP/1.1'
+
+    def _respond(self, body: dict) -> None:
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_HEAD(self):
+        self._respond({})
+
+    def do_GET(self):
+        self._respond({'version': {'number': '8.8.0'}, 'tagline': 'You Know, for Search'})
+
+    def do_POST(self):
+        lines = self.rfile.read(int(self.headers['Content-Length'])).splitlines()
+        items = []
+        position = 0
+        while position < len(lines):
+            op_type, meta = next(iter(json.loads(lines[position]).items()))
+            # every action but delete is followed by its document
+            position += 1 if op_type == 'delete' else 2
+            items.append({op_type: {'_index': meta.get('_index'), '_id': meta.get('_id'), 'status': 200}})
+        self._respond({'took': 0, 'errors': False, 'items': items})
+
+    do_PUT = do_POST
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub() -> str:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubBulkHandler)
+    threading.Thread(target=server.serve_forever, name='stub-elasticsearch', daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}'
+
+
+def _scans(plan: dict) -> Iterator[str]:
+    """Describe every scan node of a plan, e.g. 'Index Only Scan using genre_film_work_genre_fw_idx on genre_film_work'"""
+    if plan['Node Type'].endswith('Scan'):
+        description = plan['Node Type']
+        if 'Index Name' in plan:
+            description += f" using {plan['Index Name']}"
+        if 'Relation Name' in plan:
+            description += f" on {plan['Relation Name']}"
+        yield description
+    for child in plan.get('Plans', ()):
+        yield from _scans(child)
+
+
+def explain() -> dict:
+    """EXPLAIN ANALYZE the queries the ETL runs on every cycle against the latest rows"""
+    report = {'batch_size': config.BATCH_SIZE, 'tables': {}, 'queries': {}}
+    with closing(connect()) as conn, conn.cursor() as cursor:
+        for table_name in ('film_work', 'genre', 'person', 'genre_film_work', 'person_film_work'):
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass;', (f'content.{table_name}',))
+            report['tables'][table_name] = cursor.fetchone()[0]
+        latest = {}
+        for table_name in ('film_work', 'genre', 'person'):
+            cursor.execute(f'SELECT id, modified FROM content.{table_name} ORDER BY modified DESC, id DESC LIMIT %s;',
+                           (config.BATCH_SIZE,))
+            latest[table_name] = cursor.fetchall()
+
+        queries = {}
+        for table_name, rows in latest.items():
+            if rows:
+                # nothing changed since the newest row, as in most polling cycles
+                queries[f'select_modified_ids_{table_name}'] = (
+                    SQL.select_modified_ids(table_name, limit=config.BATCH_SIZE), (rows[0][1], rows[0][0]),
+                )
+        for table_name in ('genre', 'person'):
+            if latest[table_name]:
+                queries[f'select_film_works_from_{table_name}'] = (
+                    SQL.select_film_works_from(table_name), ([row[0] for row in latest[table_name]],),
+                )
+        if latest['film_work']:
+            queries['enrich_film_works'] = (SQL.enrich_film_works(), ([row[0] for row in latest['film_work']],))
+
+        for name, (sql, params) in queries.items():
+            cursor.execute(f'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}', params)
+            result = cursor.fetchone()[0][0]
+            report['queries'][name] = {
+                'scans': list(_scans(result['Plan'])),
+                'rows': result['Plan']['Actual Rows'],
+                'planning_ms': round(result['Planning Time'], 3),
+                'execution_ms': round(result['Execution Time'], 3),
+                'shared_blocks_read': result['Plan'].get('Shared Read Blocks', 0),
+            }
+    return report
+
+
+def counter_value(name: str, labels: Optional[dict] = None) -> float:
+    return REGISTRY.get_sample_value(name, labels or {}) or 0.0
+
+
+def run_index(es: Elasticsearch, alias: str, stub: bool) -> dict:
+    """Load the whole table of an index through the pipeline"""
+    index = f'benchmark_{alias}'
+    if not stub:
+        body = get_index(CLASS_NAMES[alias])
+        es.indices.create(index=index, body={**body, 'settings': {**body['settings'], **BULK_LOAD_SETTINGS}})
+
+    rows_before = counter_value('etl_rows_total', {'index': alias})
+    documents_before = counter_value('etl_documents_total', {'index': index, 'op_type': 'index'})
+    started = perf_counter()
+    pipeline = build_pipeline(es, index_names={alias: index})
+    pipeline.start()
+    Extractor([(alias, alias, State(MemoryStorage()))]).run_cycle(pipeline)
+    pipeline.stop()
+    seconds = perf_counter() - started
+
+    if not stub:
+        es.indices.delete(index=index)
+    rows = counter_value('etl_rows_total', {'index': alias}) - rows_before
+    return {
+        'rows': int(rows),
+        'documents': int(counter_value('etl_documents_total', {'index': index, 'op_type': 'index'}) - documents_before),
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(rows / seconds, 1) if seconds else None,
+    }
+
+
+def benchmark(args: argparse.Namespace) -> dict:
+    stub = args.elastic is None
+    es = Elasticsearch(start_stub() if stub else args.elastic)
+    report = {
+        'elasticsearch': 'stub' if stub else args.elastic,
+        'python': platform.python_version(),
+        'settings': {
+            name: getattr(config, name) for name in (
+                'BATCH_SIZE', 'ITERSIZE', 'QUEUE_SIZE', 'ENRICH_WORKERS', 'TRANSFORM_WORKERS',
+                'BULK_THREADS', 'BULK_CHUNK_SIZE', 'VALIDATE_DOCUMENTS',
+            )
+        },
+        'indices': {alias: run_index(es, alias, stub) for alias in args.aliases or CLASS_NAMES},
+        'stages': {
+            stage: {
+                'seconds': round(counter_value('etl_stage_seconds_sum', {'stage': stage}), 3),
+                'batches': int(counter_value('etl_stage_seconds_count', {'stage': stage})),
+            }
+            for stage in STAGES
+        },
+        'bulk_rejected': int(counter_value('etl_bulk_rejected_total')),
+        # kilobytes on Linux
+        'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure ETL throughput on a synthetic catalog')
+    parser.add_argument('--generate', action='store_true', help='insert synthetic rows instead of running the ETL')
+    parser.add_argument('--explain', action='store_true', help='report query plans instead of running the ETL')
+    parser.add_argument('--films', type=int, default=10_000)
+    parser.add_argument('--persons', type=int, default=5_000)
+    parser.add_argument('--genres', type=int, default=30)
+    parser.add_argument('--persons-per-film', type=int, default=8)
+    parser.add_argument('--genres-per-film', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--chunk', type=int, default=50_000, help='rows inserted per transaction')
+    parser.add_argument('--index', dest='aliases', action='append', choices=list(CLASS_NAMES),
+                        help='index to load, all indices by default')
+    parser.add_argument('--elastic', help='Elasticsearch URL, a stub bulk endpoint by default')
+    parser.add_argument('--output', help='file to write the JSON report to instead of stdout')
+    args = parser.parse_args()
+
+    if args.generate:
+        generate(args)
+    else:
+        result = json.dumps(explain() if args.explain else benchmark(args), indent=2)
+        if args.output:
+            with open(args.output, 'w') as report_file:
+                report_file.write(result)
+        else:
+            print(result)
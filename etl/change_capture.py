@@ -0,0 +1,117 @@
+import select
+from time import sleep
+from threading import Lock
+from contextlib import closing
+from collections import defaultdict
+
+import backoff
+
+from logger import logger
+from sql import SQL
+from db import CONNECTION_ERRORS, Connection, connect
+
+CHANNEL = 'etl_changes'
+
+
+@backoff.on_exception(backoff.expo,
+                      CONNECTION_ERRORS,
+                      logger=logger)
+def set_change_capture(enabled: bool) -> None:
+    """Make triggers fill the change queue only while it is read"""
+    with closing(connect()) as conn, conn, conn.cursor() as cursor:
+        cursor.execute(SQL.set_change_capture(), (enabled,))
+
+
+def claim_changes(conn: Connection, limit: int) -> dict[str, list]:
+    """Take the oldest rows off the change queue grouped by table name
+
+    Claimed rows are deleted at once, so a crash may lose them. They are
+    picked up later by polling, which stays the source of truth.
+    """
+    changes = defaultdict(set)
+    with conn, conn.cursor() as cursor:
+        cursor.execute(SQL.claim_changes(), (limit,))
+        for table_name, row_id in cursor.fetchall():
+            changes[table_name].add(row_id)
+    return {table_name: list(ids) for table_name, ids in changes.items()}
+
+
+class ChangeListener:
+    """ Wait for notifications sent by the change queue triggers """
+
+    def __init__(self):
+        self.conn = None
+
+    def wait(self, timeout: float) -> bool:
+        """Block until a notification arrives, return False on timeout"""
+        try:
+            if self.conn is None or self.conn.closed:
+                self.conn = connect()
+                self.conn.autocommit = True
+                with self.conn.cursor() as cursor:
+                    cursor.execute(f'LISTEN {CHANNEL};')
+                # changes made while not listening are still in the queue
+                return True
+
+            if select.select([self.conn], [], [], timeout) == ([], [], []):
+                return False
+            self.conn.poll()
+            self.conn.notifies.clear()
+            return True
+        except CONNECTION_ERRORS:
+            logger.exception('Lost connection listening to %s', CHANNEL)
+            self.conn = None
+            sleep(1)
+            return True
+
+
+class TombstoneQueue:
+    """ Hand out rows recorded by the delete triggers and remove them once loaded
+
+    The commit stage treats it like a State: set_state() acknowledges the
+    tombstones of a loaded batch and flush() deletes them from the table.
+    Reading restarts from the first tombstone whenever nothing is in flight,
+    so rows committed out of id order are not skipped.
+    """
+
+    def __init__(self):
+        self.conn = None
+        self._position = 0
+        self._in_flight = 0
+        self._acknowledged = []
+        self._acknowledged_claims = 0
+        self._lock = Lock()
+
+    def claim(self, conn: Connection, limit: int) -> list[tuple]:
+        """Read next tombstones as (id, table_name, row_id, version)"""
+        with self._lock:
+            if not self._in_flight:
+                self._position = 0
+            position = self._position
+        with conn, conn.cursor() as cursor:
+            cursor.execute(SQL.select_tombstones(), (position, limit))
+            rows = cursor.fetchall()
+        if rows:
+            with self._lock:
+                self._position = rows[-1][0]
+                self._in_flight += 1
+        return rows
+
+    def set_state(self, key: str, tombstone_ids: list) -> None:
+        with self._lock:
+            self._acknowledged.extend(tombstone_ids)
+            self._acknowledged_claims += 1
+
+    def flush(self) -> None:
+        with self._lock:
+            tombstone_ids, claims = self._acknowledged, self._acknowledged_claims
+            self._acknowledged, self._acknowledged_claims = [], 0
+        self.conn = connect(self.conn)
+        try:
+            with self.conn, self.conn.cursor() as cursor:
+                cursor.execute(SQL.delete_tombstones(), (tombstone_ids,))
+        except CONNECTION_ERRORS:
+            # deletes are idempotent, the tombstones are read again later
+            logger.exception('Failed to remove %s loaded tombstones', len(tombstone_ids))
+        with self._lock:
+            self._in_flight -= claims
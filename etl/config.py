@@ -0,0 +1,81 @@
+import os
+import socket
+from dotenv import load_dotenv
+
+dotenv_path = os.path.abspath(os.path.dirname(__file__) + '/../config/.env')
+load_dotenv(dotenv_path)
+
+DSN = {
+    'dbname': os.environ.get('DB_NAME'),
+    'user': os.environ.get('DB_USER'),
+    'password': os.environ.get('DB_PASSWORD'),
+    'host': os.environ.get('DB_HOST'),
+    'port': os.environ.get('DB_PORT'),
+    'options': '-c search_path=content',
+}
+
+ELASTIC_URL = f"http://{os.environ.get('ELASTIC_HOST')}:{os.environ.get('ELASTIC_PORT')}"
+
+# Pause between polling cycles, seconds
+ITER_PAUSE_TIME = int(os.environ.get('ETL_ITER_PAUSE_TIME') or 5)
+
+# Ids extracted per page and passed to the pipeline as one batch
+BATCH_SIZE = int(os.environ.get('ETL_BATCH_SIZE', 500))
+
+# Max ids of changed documents collected and deduplicated in memory during one cycle
+CYCLE_MAX_IDS = int(os.environ.get('ETL_CYCLE_MAX_IDS', 100_000))
+
+# Max number of batches waiting between two pipeline stages
+QUEUE_SIZE = int(os.environ.get('ETL_QUEUE_SIZE', 8))
+
+# Number of concurrent workers (each enrich worker holds its own Postgres connection)
+ENRICH_WORKERS = int(os.environ.get('ETL_ENRICH_WORKERS', 4))
+TRANSFORM_WORKERS = int(os.environ.get('ETL_TRANSFORM_WORKERS', 2))
+
+# Rows fetched per round trip by server-side cursors and passed on as one batch part
+ITERSIZE = int(os.environ.get('ETL_ITERSIZE', 100))
+
+# Where to keep ETL state: "json" files or "postgres" table content.etl_state
+STATE_STORAGE = os.environ.get('ETL_STATE_STORAGE', 'json')
+
+# Max seconds between state flushes while the pipeline is busy
+STATE_FLUSH_INTERVAL = float(os.environ.get('ETL_STATE_FLUSH_INTERVAL', 1))
+
+# "poll" checks modified columns every ETL_ITER_PAUSE_TIME seconds and switches the change queue triggers off,
+# "notify" wakes up on queued changes and polls modified columns every ETL_POLL_FALLBACK_INTERVAL seconds
+CHANGE_CAPTURE = os.environ.get('ETL_CHANGE_CAPTURE', 'poll')
+POLL_FALLBACK_INTERVAL = int(os.environ.get('ETL_POLL_FALLBACK_INTERVAL', 60))
+
+# Elasticsearch bulk loading: concurrent requests, actions and bytes per request,
+# initial pause in seconds before sending failed actions again
+BULK_THREADS = int(os.environ.get('ETL_BULK_THREADS', 4))
+BULK_CHUNK_SIZE = int(os.environ.get('ETL_BULK_CHUNK_SIZE', 500))
+BULK_MAX_CHUNK_BYTES = int(os.environ.get('ETL_BULK_MAX_CHUNK_BYTES', 10 * 1024 * 1024))
+BULK_RETRY_BACKOFF = float(os.environ.get('ETL_BULK_RETRY_BACKOFF', 0.5))
+
+# sqlite file with hashes of indexed documents used to skip unchanged ones, empty to disable
+FINGERPRINT_CACHE = os.environ.get('ETL_FINGERPRINT_CACHE', 'fingerprints.sqlite')
+
+# Build documents through pydantic models validating every field (slow, for debugging)
+VALIDATE_DOCUMENTS = os.environ.get('ETL_VALIDATE_DOCUMENTS', '') not in ('', '0', 'false')
+
+# "threads" runs the pipeline of blocking stages, "async" the asyncio engine
+ENGINE = os.environ.get('ETL_ENGINE', 'threads')
+
+# Write renamed genres and persons into film work documents by update_by_query
+# instead of re-enriching every film work of them, threaded engine only
+PARTIAL_UPDATES = os.environ.get('ETL_PARTIAL_UPDATES', '1' if ENGINE == 'threads' else '') not in ('', '0', 'false')
+
+# Address and port of the Prometheus metrics endpoint, port 0 disables it.
+# Served on the local interface only, set ETL_METRICS_ADDR=0.0.0.0 to let other hosts scrape it
+METRICS_ADDR = os.environ.get('ETL_METRICS_ADDR', '127.0.0.1')
+METRICS_PORT = int(os.environ.get('ETL_METRICS_PORT', 9100))
+
+# Several instances share the work through the content.etl_work table, one of them extracts changes.
+# Needs ETL_STATE_STORAGE=postgres. Claimed work returns to the queue after ETL_WORK_LEASE seconds,
+# the leader stops extracting while ETL_WORK_QUEUE_MAX batches are waiting.
+# The local fingerprint cache is not used, nodes would not see documents loaded by the others.
+DISTRIBUTED = os.environ.get('ETL_DISTRIBUTED', '') not in ('', '0', 'false')
+NODE_NAME = os.environ.get('ETL_NODE_NAME', f'{socket.gethostname()}-{os.getpid()}')
+WORK_LEASE = int(os.environ.get('ETL_WORK_LEASE', 300))
+WORK_QUEUE_MAX = int(os.environ.get('ETL_WORK_QUEUE_MAX', 1000))
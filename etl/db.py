@@ -0,0 +1,44 @@
+from contextlib import closing
+
+import psycopg2
+from psycopg2.extensions import connection
+
+import config
+
+# closing a lost connection raises InterfaceError
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+class Connection(connection):
+    """ Connection remembering statements prepared during its life """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+def connect(conn: Connection = None) -> Connection:
+    """Return an open connection, reconnecting if the given one has been lost"""
+    if conn is None or conn.closed:
+        conn = psycopg2.connect(**config.DSN, connection_factory=Connection)
+    return conn
+
+
+def database_now() -> str:
+    with closing(connect()) as conn, conn, conn.cursor() as cursor:
+        cursor.execute('SELECT now();')
+        return str(cursor.fetchone()[0])
+
+
+def numbered_params(sql: str, params_count: int) -> str:
+    """Replace %s placeholders with $1, $2, ... used by server-side statements"""
+    return sql % tuple(f'${number}' for number in range(1, params_count + 1))
+
+
+def execute_prepared(cursor, name: str, sql: str, params: tuple) -> None:
+    """Execute a statement prepared once for the connection of a cursor"""
+    conn = cursor.connection
+    if name not in conn.prepared:
+        cursor.execute(f'PREPARE {name} AS {numbered_params(sql, len(params))}')
+        conn.prepared.add(name)
+    cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
@@ -1,10 +0,0 @@
-from functools import wraps
-
-
-def coroutine(func):
-    @wraps(func)
-    def inner(*args, **kwargs):
-        fn = func(*args, **kwargs)
-        next(fn)
-        return fn
-    return inner
\ No newline at end of file
@@ -0,0 +1,169 @@
+"""Several ETL instances sharing the work through Postgres
+
+The instance holding the advisory lock is the leader: it extracts changes
+like a single instance would, but publishes batches of ids into
+content.etl_work and saves its positions in the same transaction. Every
+instance, the leader included, claims batches with FOR UPDATE SKIP LOCKED,
+loads them through its own pipeline and deletes them once committed. When
+the leader dies its session lock is released and another instance takes
+over from the saved positions; batches claimed by a dead instance are
+claimed again once their lease expires.
+"""
+from time import sleep
+from itertools import zip_longest
+from threading import Lock
+
+import backoff
+
+import config
+from sql import SQL
+from db import CONNECTION_ERRORS, connect
+from logger import logger
+from pipeline import Batch, Pipeline
+from state.models import State
+from extract import Extractor
+
+
+class Leadership:
+    """ Session-level advisory lock kept on a dedicated connection """
+
+    def __init__(self):
+        self.conn = None
+        self.leader = False
+
+    def acquire(self) -> bool:
+        """Try to become the leader, return whether this instance leads"""
+        try:
+            if self.conn is None or self.conn.closed:
+                self.conn = connect()
+                self.conn.autocommit = True
+                self.leader = False
+            with self.conn.cursor() as cursor:
+                if self.leader:
+                    # the lock lives as long as the session does
+                    cursor.execute('SELECT 1;')
+                else:
+                    cursor.execute(SQL.try_leadership())
+                    self.leader = cursor.fetchone()[0]
+                    if self.leader:
+                        logger.info('Node %s became the ETL leader', config.NODE_NAME)
+        except CONNECTION_ERRORS:
+            logger.exception('Lost leadership connection')
+            self.conn = None
+            self.leader = False
+        return self.leader
+
+
+class WorkPublisher:
+    """ Takes the place of the pipeline for the extractor of the leader
+
+    Batches are inserted into content.etl_work, and positions of Postgres
+    states are written in the same transaction. Other checkpoints, like
+    tombstones, are saved once the batch is committed.
+    """
+
+    def __init__(self):
+        self.conn = None
+
+    def submit(self, batch: Batch) -> None:
+        self.conn = connect(self.conn)
+        with self.conn, self.conn.cursor() as cursor:
+            if batch.ids or batch.deleted:
+                deleted, versions = zip(*batch.deleted) if batch.deleted else ((), ())
+                cursor.execute(SQL.insert_work(), (batch.index, batch.ids, list(deleted), list(versions)))
+            states = {}
+            for state, key, position in batch.checkpoints:
+                state.set_state(key, position)
+                if isinstance(state, State):
+                    states[id(state)] = state
+            for state in states.values():
+                state.storage.write(cursor, state.snapshot())
+        for state, _, _ in batch.checkpoints:
+            if not isinstance(state, State):
+                state.flush()
+
+    @backoff.on_exception(backoff.expo,
+                          CONNECTION_ERRORS,
+                          logger=logger)
+    def backlog(self) -> int:
+        self.conn = connect(self.conn)
+        with self.conn, self.conn.cursor() as cursor:
+            cursor.execute(SQL.count_work())
+            return cursor.fetchone()[0]
+
+
+class WorkQueue:
+    """ Claims batches for the pipeline of this instance
+
+    The commit stage treats it like a State: set_state() acknowledges a
+    loaded batch and flush() deletes acknowledged batches from the table.
+    """
+
+    def __init__(self):
+        self.conn = None
+        self._flush_conn = None
+        self._acknowledged = []
+        self._lock = Lock()
+
+    @backoff.on_exception(backoff.expo,
+                          CONNECTION_ERRORS,
+                          logger=logger)
+    def claim(self, limit: int) -> list[Batch]:
+        self.conn = connect(self.conn)
+        with self.conn, self.conn.cursor() as cursor:
+            cursor.execute(SQL.claim_work(), (config.NODE_NAME, config.WORK_LEASE, limit))
+            rows = cursor.fetchall()
+        return [
+            # batches published before deletions were versioned have no versions
+            Batch(index, ids, [(self, 'work', work_id)], deleted=list(zip_longest(deleted, versions[:len(deleted)])))
+            for work_id, index, ids, deleted, versions in rows
+        ]
+
+    def set_state(self, key: str, work_id: int) -> None:
+        with self._lock:
+            self._acknowledged.append(work_id)
+
+    def flush(self) -> None:
+        with self._lock:
+            work_ids, self._acknowledged = self._acknowledged, []
+        self._flush_conn = connect(self._flush_conn)
+        try:
+            with self._flush_conn, self._flush_conn.cursor() as cursor:
+                cursor.execute(SQL.delete_work(), (work_ids,))
+        except CONNECTION_ERRORS:
+            # the batches are claimed again after the lease and loaded once more
+            logger.exception('Failed to remove %s loaded work batches', len(work_ids))
+
+
+def reload_sources(sources: list[tuple[str, str, State]]) -> list[tuple[str, str, State]]:
+    """Read states saved by the previous leader again, one State per storage"""
+    states = {}
+    return [
+        (index, table_name, states.setdefault(id(state), State(state.storage)))
+        for index, table_name, state in sources
+    ]
+
+
+def run(pipeline: Pipeline, sources: list[tuple[str, str, State]]) -> None:
+    """Lead when possible and load claimed batches forever"""
+    leadership = Leadership()
+    publisher = WorkPublisher()
+    work = WorkQueue()
+    extractor = None
+    while True:
+        if leadership.acquire():
+            extractor = extractor or Extractor(reload_sources(sources))
+            if publisher.backlog() < config.WORK_QUEUE_MAX:
+                extractor.purge_queue()
+                extractor.run_tombstone_cycle(publisher)
+                extractor.run_cycle(publisher)
+        else:
+            extractor = None
+
+        # a few batches at a time, so the leader keeps extracting while the queue is busy
+        batches = work.claim(config.QUEUE_SIZE)
+        for batch in batches:
+            pipeline.submit(batch)
+        pipeline.check()
+        if not batches:
+            sleep(config.ITER_PAUSE_TIME)
@@ -0,0 +1,58 @@
+"""Elasticsearch documents serialized straight from enriched rows
+
+Key order matches the pydantic models in state.models, so documents built
+with ETL_VALIDATE_DOCUMENTS enabled are byte for byte the same. The last
+column of every enriched row is the external version of its document.
+"""
+from typing import Iterable, Iterator, Optional
+
+import orjson
+from pydantic import BaseModel
+
+
+class Document:
+    """ Serialized source of an Elasticsearch document
+
+    version is the latest modification of the rows the document is built
+    from, in microseconds, so Elasticsearch drops writes older than the
+    indexed document.
+    """
+    __slots__ = ('uuid', 'source', 'version')
+
+    def __init__(self, uuid, source: bytes, version: Optional[int] = None):
+        self.uuid = uuid
+        self.source = source
+        self.version = version
+
+    @classmethod
+    def from_model(cls, model: BaseModel, version: Optional[int] = None) -> 'Document':
+        return cls(model.uuid, orjson.dumps(model.dict()), version)
+
+
+def genre_documents(sql_results: Iterable) -> Iterator[Document]:
+    for result in sql_results:
+        yield Document(result[0], orjson.dumps({'uuid': result[0], 'name': result[1]}), result[3])
+
+
+def person_documents(sql_results: Iterable) -> Iterator[Document]:
+    for result in sql_results:
+        yield Document(result[0], orjson.dumps({'uuid': result[0], 'full_name': result[1]}), result[2])
+
+
+def film_work_documents(sql_results: Iterable) -> Iterator[Document]:
+    for result in sql_results:
+        roles = {'actor': [], 'writer': [], 'director': []}
+        for person in result[7]:
+            persons = roles.get(person['role'])
+            if persons is not None:
+                persons.append({'uuid': person['id'], 'full_name': person['name']})
+        yield Document(result[0], orjson.dumps({
+            'uuid': result[0],
+            'imdb_rating': result[3],
+            'title': result[1],
+            'description': result[2],
+            'genre': [{'uuid': genre['id'], 'name': genre['name']} for genre in result[8]],
+            'actors': roles['actor'],
+            'writers': roles['writer'],
+            'directors': roles['director'],
+        }), result[9])
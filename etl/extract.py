@@ -0,0 +1,363 @@
+"""Extraction, enrichment and transformation shared by every way to run the ETL
+
+postgres_elastic_sync.py is the entry point of the incremental sync, and
+the backfill, reindex, distributed and async engine modules build on the
+extractor, the enricher and the pipeline defined here.
+"""
+from time import sleep
+from typing import Iterable, Iterator, Optional
+from datetime import datetime
+from dataclasses import replace
+from collections import defaultdict
+
+import backoff
+from elasticsearch import Elasticsearch
+
+import config
+import metrics
+from sql import SQL
+from db import CONNECTION_ERRORS, connect, execute_prepared
+from logger import logger
+from change_capture import TombstoneQueue, claim_changes
+from loader import Loader
+from fingerprints import FingerprintCache
+from partial_updates import PartialUpdater
+from documents import film_work_documents, genre_documents, person_documents, Document
+from pipeline import Batch, Pipeline, WatermarkCommitter
+from state.models import State, FilmWork, Person, Genre
+from state.base_storage import BaseStorage
+from state.json_file_storage import JsonFileStorage
+from state.postgres_storage import PostgresStorage
+
+
+INDICES = {
+    Genre.__name__: 'genre',
+    Person.__name__: 'person',
+    FilmWork.__name__: 'film_work'
+}
+
+GENRE_TABLE_NAME = 'genre'
+PERSON_TABLE_NAME = 'person'
+FILM_WORK_TABLE_NAME = 'film_work'
+
+TABLE_NAMES = (
+    GENRE_TABLE_NAME,
+    PERSON_TABLE_NAME,
+    FILM_WORK_TABLE_NAME,
+)
+
+MIN_UUID = '00000000-0000-0000-0000-000000000000'
+
+
+def _id_separator(results: list[str, datetime]) -> tuple[list, dict]:
+    """Separate list of ids and (modified, id) cursor of the last row"""
+    ids = [result[0] for result in results]
+    last_id, last_modified = results[-1][0], results[-1][1]
+    return ids, {'modified': str(last_modified), 'id': str(last_id)}
+
+def get_cursor(state: State, table_name: str) -> dict:
+    """Read (modified, id) cursor saved for a given table"""
+    saved = state.get_state(table_name)
+    if isinstance(saved, dict):
+        return saved
+    # states saved before keyset pagination keep the timestamp only
+    return {'modified': saved or str(datetime.min), 'id': MIN_UUID}
+
+
+def extract_changed_from(conn, table_name: str, last_modified: dict) -> Iterator[tuple[list, dict]]:
+    """Collect ids of modified rows from a given table page by page after a (modified, id) cursor"""
+    logger.info('Looking for changed data for indexing in %s', table_name)
+    while True:
+        # pages are limited, so they are fetched at once by a client-side cursor
+        with metrics.STAGE_SECONDS.labels('extract').time(), conn, conn.cursor() as cursor:
+            execute_prepared(cursor, f'select_modified_ids_{table_name}',
+                             SQL.select_modified_ids(table_name, limit=config.BATCH_SIZE),
+                             (last_modified['modified'], last_modified['id']))
+            results = cursor.fetchall()
+        if not results:
+            break
+        logger.info('Fetching %s rows from %s changed after %s', len(results), table_name, last_modified)
+        ids, last_modified = _id_separator(results)
+        yield ids, last_modified
+
+
+def extract_film_works_from_changed(conn, table_name: str, ids: list) -> Iterator[list]:
+    """ Collect ids of film works corresponded to the modified rows """
+    logger.info('Fetching film works related to rows fetched from %s', table_name)
+    sql = SQL.select_film_works_from(table_name)
+    with conn, conn.cursor(name='film_works_from_changed') as cursor:
+        cursor.itersize = config.ITERSIZE
+        cursor.execute(sql, (ids,))
+        while results := cursor.fetchmany(size=config.BATCH_SIZE):
+            yield [result[0] for result in results]
+
+
+class Extractor:
+    """ Turn rows changed since the last cycle into batches of ids to index """
+
+    def __init__(self, sources: list[tuple[str, str, State]], partial_updates: Optional[PartialUpdater] = None):
+        self.sources = sources
+        self.conn = None
+        # renames of genres and persons are applied to film works in place
+        self.partial_updates = partial_updates
+        self.tombstones = TombstoneQueue()
+        # extraction runs ahead of the states which are saved only after loading
+        self.positions = {
+            (index, table_name): get_cursor(state, table_name) for index, table_name, state in sources
+        }
+
+    @backoff.on_exception(backoff.expo,
+                          CONNECTION_ERRORS,
+                          logger=logger)
+    def run_cycle(self, pipeline: Pipeline) -> None:
+        """Poll every source for rows modified after its position
+
+        Ids of every index are collected from all of its sources first, so a
+        document changed through several tables is indexed once per cycle.
+        At most CYCLE_MAX_IDS ids are kept in memory, larger cycles are split.
+        Renamed rows served by partial updates are passed on as checkpoints.
+        """
+        self.conn = connect(self.conn)
+        for index in dict.fromkeys(index for index, _, _ in self.sources):
+            sources = [(table_name, state) for source_index, table_name, state in self.sources if source_index == index]
+            exhausted = False
+            while not exhausted:
+                dirty = set()
+                renamed = defaultdict(set)
+                positions = {}
+                exhausted = True
+                for table_name, state in sources:
+                    key = (index, table_name)
+                    for ids, last_modified in extract_changed_from(self.conn, table_name, self.positions[key]):
+                        self._collect(dirty, index, table_name, ids, renamed)
+                        positions[key] = (state, last_modified)
+                        if len(dirty) + sum(map(len, renamed.values())) >= config.CYCLE_MAX_IDS:
+                            exhausted = False
+                            break
+                    else:
+                        metrics.observe_caught_up(index, table_name, positions.get(key, (state, self.positions[key]))[1])
+                    if not exhausted:
+                        break
+
+                # renames go first, positions are saved once they are applied
+                checkpoints = [
+                    *((self.partial_updates, table_name, list(ids)) for table_name, ids in renamed.items()),
+                    *((state, table_name, position) for (_, table_name), (state, position) in positions.items()),
+                ]
+                self._submit(pipeline, index, dirty, checkpoints)
+                for key, (_, position) in positions.items():
+                    self.positions[key] = position
+        metrics.CYCLE.set_to_current_time()
+
+    @backoff.on_exception(backoff.expo,
+                          CONNECTION_ERRORS,
+                          logger=logger)
+    def run_queue_cycle(self, pipeline: Pipeline) -> None:
+        """Drain the change queue filled by triggers"""
+        self.conn = connect(self.conn)
+        while changes := claim_changes(self.conn, config.BATCH_SIZE):
+            logger.info('Claimed changes from queue: %s', {name: len(ids) for name, ids in changes.items()})
+            dirty = defaultdict(set)
+            renamed = defaultdict(lambda: defaultdict(set))
+            for index, table_name, _ in self.sources:
+                if table_name in changes:
+                    self._collect(dirty[index], index, table_name, changes[table_name], renamed[index])
+            for index, ids in dirty.items():
+                self._submit(pipeline, index, ids, [
+                    (self.partial_updates, table_name, list(row_ids)) for table_name, row_ids in renamed[index].items()
+                ])
+
+    @backoff.on_exception(backoff.expo,
+                          CONNECTION_ERRORS,
+                          logger=logger)
+    def run_tombstone_cycle(self, pipeline: Pipeline) -> None:
+        """Delete documents of rows removed from Postgres"""
+        self.conn = connect(self.conn)
+        while rows := self.tombstones.claim(self.conn, config.BATCH_SIZE):
+            deleted = defaultdict(list)
+            for _, table_name, row_id, version in rows:
+                deleted[table_name].append((row_id, version))
+            logger.info('Deleting from indices: %s', {name: len(ids) for name, ids in deleted.items()})
+
+            # related film works are re-enriched as removing links updates them
+            batches = [
+                Batch(index, [], deleted=deleted[table_name])
+                for index, table_name, _ in self.sources
+                if index == table_name and table_name in deleted
+            ] or [Batch(INDICES[FilmWork.__name__], [])]
+            batches[-1].checkpoints.append((self.tombstones, 'tombstones', [row[0] for row in rows]))
+            for batch in batches:
+                pipeline.submit(batch)
+
+    @backoff.on_exception(backoff.expo,
+                          CONNECTION_ERRORS,
+                          logger=logger)
+    def purge_queue(self) -> None:
+        """Drop queued changes which polling picks up anyway"""
+        self.conn = connect(self.conn)
+        with self.conn, self.conn.cursor() as cursor:
+            cursor.execute(SQL.purge_changes())
+
+    def _collect(self, dirty: set, index: str, table_name: str, ids: list, renamed: dict) -> None:
+        """Add ids of documents of an index affected by changed rows of a table"""
+        if index == table_name:
+            dirty.update(ids)
+            return
+        if self.partial_updates and self.partial_updates.serves(index, table_name):
+            renamed[table_name].update(ids)
+            return
+        for film_work_ids in extract_film_works_from_changed(self.conn, table_name, ids):
+            dirty.update(film_work_ids)
+
+    @staticmethod
+    def _submit(pipeline: Pipeline, index: str, ids: set, checkpoints: list = ()) -> None:
+        """Split ids into batches, the last one carries checkpoints"""
+        ids = list(ids)
+        batches = [Batch(index, ids[start:start + config.BATCH_SIZE]) for start in range(0, len(ids), config.BATCH_SIZE)]
+        if checkpoints:
+            if not batches:
+                batches.append(Batch(index, []))
+            batches[-1].checkpoints.extend(checkpoints)
+        for batch in batches:
+            pipeline.submit(batch)
+
+
+class Enricher:
+    """ Enrich ids of a batch with all data available, one connection per worker """
+
+    SQL = {
+        FILM_WORK_TABLE_NAME: SQL.enrich_film_works,
+        GENRE_TABLE_NAME: SQL.enrich_genres,
+        PERSON_TABLE_NAME: SQL.enrich_persons,
+    }
+
+    def __init__(self):
+        self.conn = None
+
+    def __call__(self, batch: Batch) -> Iterator[Batch]:
+        """Split a batch into parts of at most ITERSIZE enriched rows"""
+        part = 0
+        if batch.ids:
+            logger.info('Enriching %s %s rows', len(batch.ids), batch.index)
+            for rows in self._stream(batch):
+                yield replace(batch, rows=rows, part=part, last_part=False)
+                part += 1
+        yield replace(batch, part=part, last_part=True)
+
+    def _stream(self, batch: Batch) -> Iterator[list]:
+        """Fetch rows through a server-side cursor, resuming with the ids left when the connection is lost"""
+        pending = set(batch.ids)
+        attempt = 0
+        while True:
+            try:
+                self.conn = connect(self.conn)
+                with self.conn, self.conn.cursor(name='enrich') as cursor:
+                    cursor.itersize = config.ITERSIZE
+                    cursor.execute(self.SQL[batch.index](), (list(pending),))
+                    while rows := cursor.fetchmany(size=config.ITERSIZE):
+                        pending.difference_update(row[0] for row in rows)
+                        metrics.ROWS.labels(batch.index).inc(len(rows))
+                        yield rows
+                return
+            except CONNECTION_ERRORS:
+                logger.exception('Lost connection while enriching %s, %s ids left', batch.index, len(pending))
+                sleep(min(2 ** attempt, 60))
+                attempt += 1
+
+
+def transform_genres(sql_results: Iterable) -> Iterator[Genre]:
+    """ Transform genres Postgres entities to the Elasticsearch index format """
+    logger.info('Transforming genres data')
+
+    for result in sql_results:
+        yield Genre(
+            uuid=result[0],
+            name=result[1],
+            description=result[2],
+        )
+
+
+def transform_persons(sql_results: Iterable) -> Iterator[Person]:
+    """ Transform persons Postgres entities to the Elasticsearch index format """
+    logger.info('Transforming persons data')
+
+    for result in sql_results:
+        yield Person(
+            uuid=result[0],
+            full_name=result[1],
+        )
+
+
+def transform_movies(sql_results: Iterable) -> Iterator[FilmWork]:
+    """ Transform film work Postgres entities to the Elasticsearch index format """
+    logger.info('Transforming film work data')
+
+    for result in sql_results:
+        film_work = FilmWork(
+            uuid=result[0],
+            title=result[1],
+            description=result[2],
+            imdb_rating=result[3],
+            genre=[Genre(uuid=genre['id'], name=genre['name']) for genre in result[8]],
+        )
+        for person_dict in result[7]:
+            person = Person(uuid=person_dict['id'], full_name=person_dict['name'])
+            if person_dict['role'] == 'director':
+                film_work.directors.append(person)
+            elif person_dict['role'] == 'actor':
+                film_work.actors.append(person)
+            elif person_dict['role'] == 'writer':
+                film_work.writers.append(person)
+        yield film_work
+
+
+TRANSFORMERS = {
+    FILM_WORK_TABLE_NAME: transform_movies,
+    GENRE_TABLE_NAME: transform_genres,
+    PERSON_TABLE_NAME: transform_persons,
+}
+
+DOCUMENT_BUILDERS = {
+    FILM_WORK_TABLE_NAME: film_work_documents,
+    GENRE_TABLE_NAME: genre_documents,
+    PERSON_TABLE_NAME: person_documents,
+}
+
+
+def transform(batch: Batch) -> Batch:
+    """ Transform enriched rows of a batch to the documents of its index """
+    if config.VALIDATE_DOCUMENTS:
+        batch.models = [
+            Document.from_model(model, row[-1]) for model, row in zip(TRANSFORMERS[batch.index](batch.rows), batch.rows)
+        ]
+    else:
+        batch.models = list(DOCUMENT_BUILDERS[batch.index](batch.rows))
+    batch.rows = []
+    return batch
+
+
+def get_storage(name: str) -> BaseStorage:
+    """Create the state storage selected by ETL_STATE_STORAGE"""
+    if config.STATE_STORAGE == 'postgres':
+        return PostgresStorage(logger=logger, dsn=config.DSN, name=name)
+    return JsonFileStorage(logger=logger, file_path=f'{name}.json')
+
+
+def build_pipeline(es: Elasticsearch, index_names: Optional[dict] = None, skip_unchanged: bool = False) -> Pipeline:
+    def loader_factory():
+        # sqlite connections are used by the thread which opened them
+        fingerprints = FingerprintCache(config.FINGERPRINT_CACHE) if skip_unchanged and config.FINGERPRINT_CACHE else None
+        return Loader(es, index_names, fingerprints)
+
+    pipeline = Pipeline(queue_size=config.QUEUE_SIZE)
+    pipeline.add_stage('enrich', Enricher, workers=config.ENRICH_WORKERS)
+    pipeline.add_stage('transform', lambda: transform, workers=config.TRANSFORM_WORKERS)
+    pipeline.add_stage('load', loader_factory)
+    pipeline.add_stage('commit', lambda: WatermarkCommitter(pipeline, config.STATE_FLUSH_INTERVAL))
+    return pipeline
+
+
+def wait_for_elasticsearch(es: Elasticsearch) -> None:
+    while not es.ping():
+        logger.info('Waiting for Elasticsearch connection...')
+        sleep(1)
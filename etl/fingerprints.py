@@ -0,0 +1,60 @@
+import sqlite3
+from hashlib import blake2b
+from typing import Iterable
+
+
+def fingerprint(source: bytes) -> bytes:
+    return blake2b(source, digest_size=16).digest()
+
+
+class FingerprintCache:
+    """ Remember hashes of indexed documents to skip sending identical ones again
+
+    Hashes are kept in a local sqlite database, one connection per thread.
+    """
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL;')
+        self.conn.execute('PRAGMA synchronous=NORMAL;')
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS fingerprints (
+                   index_name TEXT NOT NULL,
+                   doc_id TEXT NOT NULL,
+                   digest BLOB NOT NULL,
+                   PRIMARY KEY (index_name, doc_id)
+               ) WITHOUT ROWID;"""
+        )
+        self.conn.commit()
+
+    def unchanged(self, index: str, digests: dict[str, bytes]) -> set[str]:
+        """Find ids of documents indexed with the same hash"""
+        unchanged = set()
+        ids = list(digests)
+        # stay below the sqlite limit of variables per statement
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            rows = self.conn.execute(
+                f"SELECT doc_id, digest FROM fingerprints WHERE index_name = ? AND doc_id IN ({', '.join('?' * len(chunk))});",
+                (index, *chunk),
+            )
+            unchanged.update(doc_id for doc_id, digest in rows if digest == digests[doc_id])
+        return unchanged
+
+    def remember(self, index: str, digests: dict[str, bytes]) -> None:
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO fingerprints (index_name, doc_id, digest) VALUES (?, ?, ?);',
+                ((index, doc_id, digest) for doc_id, digest in digests.items()),
+            )
+
+    def forget(self, index: str, ids: Iterable[str]) -> None:
+        with self.conn:
+            self.conn.executemany(
+                'DELETE FROM fingerprints WHERE index_name = ? AND doc_id = ?;',
+                ((index, doc_id) for doc_id in ids),
+            )
+
+    def clear(self, index: str) -> None:
+        with self.conn:
+            self.conn.execute('DELETE FROM fingerprints WHERE index_name = ?;', (index,))
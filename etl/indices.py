@@ -0,0 +1,95 @@
+import re
+from typing import Optional
+
+from elasticsearch import Elasticsearch
+
+from logger import logger
+from es_index import get_index
+
+# Settings making an index which nobody reads yet fast to fill
+BULK_LOAD_SETTINGS = {
+    'refresh_interval': '-1',
+    'number_of_replicas': 0,
+}
+
+# Seconds to wait for merging a filled index, large indices take many minutes
+MERGE_TIMEOUT = 3600
+
+
+def versioned_name(alias: str, version: int) -> str:
+    return f'{alias}_v{version}'
+
+
+def versioned_indices(es: Elasticsearch, alias: str) -> dict[str, int]:
+    """Find all versions of an index as {index name: version}"""
+    pattern = re.compile(rf'^{re.escape(alias)}_v(\d+)$')
+    names = es.indices.get(index=f'{alias}_v*', ignore_unavailable=True, allow_no_indices=True)
+    return {name: int(match.group(1)) for name in names if (match := pattern.match(name))}
+
+
+def aliased_indices(es: Elasticsearch, alias: str) -> list[str]:
+    """Find indices the alias points to"""
+    if not es.indices.exists_alias(name=alias):
+        return []
+    return list(es.indices.get_alias(name=alias))
+
+
+def is_legacy_index(es: Elasticsearch, alias: str) -> bool:
+    """Indices created before versioning carry the name used as alias now"""
+    return bool(es.indices.exists(index=alias)) and not es.indices.exists_alias(name=alias)
+
+
+def ensure_index(es: Elasticsearch, class_name: str, alias: str) -> None:
+    """Create the first version of an index behind its alias unless the alias is already served"""
+    if es.indices.exists_alias(name=alias) or es.indices.exists(index=alias):
+        return
+    name = versioned_name(alias, 1)
+    response = es.indices.create(
+        index=name,
+        body={**get_index(class_name), 'aliases': {alias: {}}},
+        ignore=400,
+    )
+    logger.info('Attempted to create Elasticsearch index %s. Response: %s', name, response)
+
+
+def create_next_version(es: Elasticsearch, class_name: str, alias: str) -> str:
+    """Create the next version of an index with bulk load settings"""
+    versions = versioned_indices(es, alias)
+    name = versioned_name(alias, max(versions.values(), default=0) + 1)
+    body = get_index(class_name)
+    es.indices.create(index=name, body={**body, 'settings': {**body['settings'], **BULK_LOAD_SETTINGS}})
+    logger.info('Created Elasticsearch index %s', name)
+    return name
+
+
+def finish_bulk_load(es: Elasticsearch, name: str, class_name: str, replicas: int) -> None:
+    """Restore search settings of a filled index and merge its segments"""
+    es.indices.put_settings(index=name, settings={
+        'refresh_interval': get_index(class_name)['settings']['refresh_interval'],
+        'number_of_replicas': replicas,
+    })
+    es.options(request_timeout=MERGE_TIMEOUT).indices.refresh(index=name)
+    es.options(request_timeout=MERGE_TIMEOUT).indices.forcemerge(index=name, max_num_segments=1)
+
+
+def current_replicas(es: Elasticsearch, alias: str, default: int = 1) -> int:
+    """Number of replicas of the index served by the alias now"""
+    indices = aliased_indices(es, alias) or ([alias] if is_legacy_index(es, alias) else [])
+    if not indices:
+        return default
+    settings = es.indices.get_settings(index=indices[0], name='index.number_of_replicas')
+    return int(settings[indices[0]]['settings']['index']['number_of_replicas'])
+
+
+def swap_alias(es: Elasticsearch, alias: str, name: str) -> list[str]:
+    """Atomically point the alias to a new index, return the indices it pointed to before"""
+    old_indices = [index for index in aliased_indices(es, alias) if index != name]
+    actions = [{'remove': {'index': index, 'alias': alias}} for index in old_indices]
+    legacy: Optional[str] = alias if is_legacy_index(es, alias) else None
+    if legacy:
+        # the alias can take the name only together with removing the old index
+        actions.append({'remove_index': {'index': legacy}})
+    actions.append({'add': {'index': name, 'alias': alias}})
+    es.indices.update_aliases(actions=actions)
+    logger.info('Alias %s moved from %s to %s', alias, old_indices or legacy, name)
+    return old_indices
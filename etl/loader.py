@@ -0,0 +1,206 @@
+from time import sleep
+from collections import defaultdict
+from typing import Iterator, Optional
+
+import backoff
+from elasticsearch import Elasticsearch, ConnectionError, helpers
+
+import config
+import metrics
+from logger import logger
+from pipeline import Batch
+from documents import Document
+from fingerprints import FingerprintCache, fingerprint
+
+# statuses worth sending the same action again
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# deleting a document which is not indexed is not an error
+IGNORE_STATUSES = (404,)
+# a newer version of the document is indexed already
+CONFLICT_STATUS = 409
+
+
+def _actions_generator(index: str, documents: list[Document], deleted: list):
+    """Yields actions for elasticsearch bulk index helper"""
+    for document in documents:
+        action = {
+            '_index': index,
+            '_id': str(document.uuid),
+            '_source': document.source,
+        }
+        if document.version is not None:
+            # equal versions pass, so reindexing rows which did not change still writes them
+            action['version'] = document.version
+            action['version_type'] = 'external_gte'
+        yield action
+    for uuid, version in deleted:
+        action = {
+            '_op_type': 'delete',
+            '_index': index,
+            '_id': str(uuid),
+        }
+        if version is not None:
+            # the deletion keeps its version, so documents enriched before it
+            # lose, as long as Elasticsearch remembers it (index.gc_deletes)
+            action['version'] = version
+            action['version_type'] = 'external_gte'
+        yield action
+
+
+class Loader:
+    """ Load information about changed models to Elasticsearch
+
+    Batches arrive in parts of at most ITERSIZE rows, so actions are grouped
+    until every bulk thread has a chunk to send, or until no more parts are
+    waiting, and batches are passed on once their actions are loaded.
+    Chunks are sent by several threads. Failed actions are sent again one by
+    one, and the loader slows down while Elasticsearch rejects requests
+    with 429 Too Many Requests.
+    """
+
+    def __init__(self,
+                 es: Elasticsearch,
+                 index_names: Optional[dict] = None,
+                 fingerprints: Optional[FingerprintCache] = None):
+        self.es = es
+        # write to other indices than the aliases batches are routed by
+        self.index_names = index_names or {}
+        # hashes of documents already indexed through the aliases
+        self.fingerprints = fingerprints
+        # pause before every bulk request, grows while requests are rejected
+        self.throttle = 0.0
+        # actions grouped by (index, whether unchanged documents are skipped) and their batches
+        self._actions = defaultdict(list)
+        self._batches = []
+        self._grouped = 0
+
+    def __call__(self, batch: Batch) -> Iterator[Batch]:
+        if batch.models or batch.deleted:
+            logger.info('Received for loading %s items and %s deletions of model %s',
+                        len(batch.models), len(batch.deleted), batch.index)
+            index = self.index_names.get(batch.index, batch.index)
+            actions = self._actions[(index, bool(self.fingerprints) and index == batch.index)]
+            size = len(actions)
+            actions.extend(_actions_generator(index, batch.models, batch.deleted))
+            self._grouped += len(actions) - size
+        batch.models = []
+        self._batches.append(batch)
+        if self._grouped >= config.BULK_CHUNK_SIZE * config.BULK_THREADS:
+            yield from self.release()
+
+    def release(self) -> Iterator[Batch]:
+        """Load grouped actions at once and pass their batches on"""
+        if self._grouped:
+            for (index, skip_unchanged), actions in self._actions.items():
+                if skip_unchanged:
+                    self._load_changed(index, actions)
+                else:
+                    self.load(actions)
+            logger.info('Loading %s actions to Elasticsearch complete', self._grouped)
+        batches = self._batches
+        self._actions.clear()
+        self._batches = []
+        self._grouped = 0
+        yield from batches
+
+    def _load_changed(self, index: str, actions: list[dict]) -> None:
+        """Load only documents differing from what was indexed before"""
+        digests = {action['_id']: fingerprint(action['_source']) for action in actions if '_source' in action}
+        unchanged = self.fingerprints.unchanged(index, digests)
+        if unchanged:
+            logger.info('Skipping %s unchanged documents of %s', len(unchanged), index)
+            metrics.SKIPPED_DOCUMENTS.labels(index).inc(len(unchanged))
+            actions = [action for action in actions if action['_id'] not in unchanged or '_source' not in action]
+
+        dropped = self.load(actions)
+        deleted = [action['_id'] for action in actions if action.get('_op_type') == 'delete']
+        self.fingerprints.remember(index, {
+            doc_id: digest for doc_id, digest in digests.items() if doc_id not in unchanged and doc_id not in dropped
+        })
+        self.fingerprints.forget(index, deleted)
+
+    def load(self, actions: list[dict]) -> set[str]:
+        """Load actions, return ids of the ones failed for good or skipped as stale"""
+        for action in actions:
+            metrics.DOCUMENTS.labels(action['_index'], action.get('_op_type', 'index')).inc()
+        dropped = set()
+        attempt = 0
+        while actions:
+            if self.throttle:
+                sleep(self.throttle)
+            failed, rejected, failed_for_good, stale = self._send(actions)
+            dropped.update(failed_for_good)
+            dropped.update(stale)
+            metrics.BULK_REJECTED.inc(rejected)
+            metrics.BULK_RETRIED.inc(len(failed))
+            metrics.BULK_FAILED.inc(len(failed_for_good))
+            self._adjust_throttle(rejected)
+            if failed:
+                logger.warning('%s of %s actions failed, %s rejected, retrying them',
+                               len(failed), len(actions), rejected)
+                sleep(min(config.BULK_RETRY_BACKOFF * 2 ** attempt, 60))
+                attempt += 1
+            actions = failed
+        return dropped
+
+    @backoff.on_exception(backoff.expo,
+                          ConnectionError,
+                          logger=logger)
+    def _send(self, actions: list[dict]) -> tuple[list[dict], int, list[str], list[str]]:
+        """Send actions, return the ones to send again, the number of rejections, ids failed for good and stale ids"""
+        by_id = {(action.get('_op_type', 'index'), action['_id']): action for action in actions}
+        if config.BULK_THREADS > 1:
+            results = helpers.parallel_bulk(
+                self.es, actions,
+                thread_count=config.BULK_THREADS,
+                chunk_size=config.BULK_CHUNK_SIZE,
+                max_chunk_bytes=config.BULK_MAX_CHUNK_BYTES,
+                raise_on_error=False,
+                raise_on_exception=False,
+                ignore_status=IGNORE_STATUSES,
+            )
+        else:
+            results = helpers.streaming_bulk(
+                self.es, actions,
+                chunk_size=config.BULK_CHUNK_SIZE,
+                max_chunk_bytes=config.BULK_MAX_CHUNK_BYTES,
+                raise_on_error=False,
+                raise_on_exception=False,
+                ignore_status=IGNORE_STATUSES,
+                yield_ok=False,
+            )
+
+        failed = []
+        rejected = 0
+        failed_for_good = []
+        stale = []
+        for ok, item in results:
+            if ok:
+                continue
+            op_type, info = item.popitem()
+            status = info.get('status')
+            if status in IGNORE_STATUSES:
+                continue
+            if status == CONFLICT_STATUS:
+                stale.append(info.get('_id'))
+                metrics.STALE_DOCUMENTS.labels(info.get('_index')).inc()
+                continue
+            if status == 429:
+                rejected += 1
+            if status in RETRY_STATUSES:
+                failed.append(by_id[(op_type, info['_id'])])
+            else:
+                failed_for_good.append(info.get('_id'))
+                logger.error('Failed to %s document %s in %s: %s',
+                             op_type, info.get('_id'), info.get('_index'), info.get('error'))
+        if stale:
+            logger.info('Skipped %s documents older than the indexed ones', len(stale))
+        return failed, rejected, failed_for_good, stale
+
+    def _adjust_throttle(self, rejected: int) -> None:
+        if rejected:
+            self.throttle = min(max(self.throttle * 2, config.BULK_RETRY_BACKOFF), 30)
+            logger.warning('Elasticsearch rejected %s actions, pausing %.2fs before bulk requests',
+                           rejected, self.throttle)
+        elif self.throttle:
+            self.throttle = self.throttle / 2 if self.throttle > 0.01 else 0.0
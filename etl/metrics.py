@@ -0,0 +1,79 @@
+"""Prometheus metrics of the ETL, served by start_http_server() from prometheus_client
+
+Throughput is the rate of the counters, e.g. rate(etl_documents_total[1m]).
+Lag is computed when the metrics are scraped, so it keeps growing while the
+ETL stalls.
+"""
+from datetime import datetime
+from time import time
+
+from prometheus_client import Counter, Gauge, Histogram
+
+STAGE_SECONDS = Histogram(
+    'etl_stage_seconds', 'Time a stage spends on one batch, waiting for the next stage excluded', ['stage'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+BATCH_SIZE = Histogram(
+    'etl_batch_size', 'Ids and deletions per submitted batch', ['index'],
+    buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000),
+)
+QUEUE_DEPTH = Gauge('etl_queue_depth', 'Batches waiting in the inbox of a stage', ['stage'])
+
+ROWS = Counter('etl_rows_total', 'Enriched rows read from Postgres', ['index'])
+DOCUMENTS = Counter('etl_documents_total', 'Actions sent to Elasticsearch', ['index', 'op_type'])
+SKIPPED_DOCUMENTS = Counter('etl_skipped_documents_total', 'Documents identical to the indexed ones', ['index'])
+STALE_DOCUMENTS = Counter('etl_stale_documents_total', 'Documents rejected for a newer indexed version', ['index'])
+PARTIAL_UPDATES = Counter('etl_partial_updates_total', 'Film work documents updated in place after renames', ['table'])
+
+BULK_REJECTED = Counter('etl_bulk_rejected_total', 'Bulk actions rejected with 429 Too Many Requests')
+BULK_RETRIED = Counter('etl_bulk_retried_total', 'Bulk actions sent again after a temporary failure')
+BULK_FAILED = Counter('etl_bulk_failed_total', 'Bulk actions failed for good')
+
+LAG = Gauge('etl_lag_seconds', 'Age of the oldest change of a source not synced yet', ['index', 'table'])
+WATERMARK = Gauge('etl_watermark_timestamp_seconds', 'Modification time of the last synced row', ['index', 'table'])
+CYCLE = Gauge('etl_cycle_timestamp_seconds', 'End of the last extraction cycle')
+
+# (index, table): modification time of the last synced row
+_watermarks = {}
+# (index, table): (time of the check, modification time of the last row found by the check)
+_caught_up = {}
+
+
+def _timestamp(position) -> float:
+    modified = datetime.fromisoformat(position['modified'])
+    # datetime.min stands for a table never synced
+    return modified.timestamp() if modified.tzinfo is not None else float('-inf')
+
+
+def _lag(key: tuple[str, str]) -> float:
+    now = time()
+    watermark = _watermarks.get(key)
+    checked_at, last_found = _caught_up.get(key, (None, None))
+    # nothing is pending when every row found by the last check is synced
+    if checked_at is not None and (watermark is None or watermark >= last_found):
+        return now - checked_at
+    if watermark is None or watermark == float('-inf'):
+        return 0
+    return now - watermark
+
+
+def _track(index: str, table_name: str) -> None:
+    key = (index, table_name)
+    if key not in _watermarks and key not in _caught_up:
+        LAG.labels(index, table_name).set_function(lambda: _lag(key))
+
+
+def observe_watermark(index: str, table_name: str, position) -> None:
+    """Record a (modified, id) watermark saved for a source of an index"""
+    if not isinstance(position, dict) or 'modified' not in position:
+        return
+    _track(index, table_name)
+    _watermarks[(index, table_name)] = timestamp = _timestamp(position)
+    if timestamp != float('-inf'):
+        WATERMARK.labels(index, table_name).set(timestamp)
+
+
+def observe_caught_up(index: str, table_name: str, position) -> None:
+    """Record that a source has no rows modified after a (modified, id) position"""
+    _track(index, table_name)
+    _caught_up[(index, table_name)] = (time(), _timestamp(position))
@@ -0,0 +1,132 @@
+"""Renames of genres and persons applied to film work documents in place
+
+Film works reference genres and persons by links, and changing links
+updates film_work.modified, so a genre or person row seen as modified by
+the film_work sources can only change its name. Instead of re-enriching
+every film work of the genre or person, the new name is written into the
+nested fields by update_by_query. Documents already holding the name are
+left untouched.
+
+Updates run when the batch carrying them is committed, so every batch
+enriched before the rename is loaded already. The index is refreshed
+first, since update_by_query sees searchable documents only, so those
+batches cannot bring the old name back. Set ETL_PARTIAL_UPDATES=0 to
+re-enrich film works instead.
+"""
+from typing import Optional
+
+import backoff
+from elasticsearch import Elasticsearch, ConnectionError
+
+import config
+import metrics
+from sql import SQL
+from db import CONNECTION_ERRORS, connect
+from logger import logger
+from fingerprints import FingerprintCache
+
+# table: (nested fields of film work documents, column and field of the name)
+NESTED_FIELDS = {
+    'genre': (('genre',), 'name'),
+    'person': (('actors', 'writers', 'directors'), 'full_name'),
+}
+
+RENAME_SCRIPT = """
+boolean changed = false;
+for (String field : params.fields) {
+    for (def item : ctx._source[field]) {
+        String name = params.names.get(item.uuid);
+        if (name != null && name != item[params.name_field]) {
+            item[params.name_field] = name;
+            changed = true;
+        }
+    }
+}
+if (!changed) {
+    ctx.op = 'noop';
+}
+"""
+
+# renaming a popular genre rewrites a large part of the index
+UPDATE_TIMEOUT = 600
+
+
+class PartialUpdateError(Exception):
+    """Raised when Elasticsearch failed to update some of the documents"""
+
+
+class PartialUpdater:
+    """ Apply renames of genres and persons to the film work index
+
+    The commit stage treats it like a State: set_state() receives ids of
+    renamed rows of a table and updates the documents right away, before
+    the positions committed with the same batch are saved.
+    """
+
+    def __init__(self, es: Elasticsearch, index: str):
+        self.es = es
+        self.index = index
+        self.conn = None
+        # opened by the commit thread, sqlite connections are used by the thread which opened them
+        self._fingerprints: Optional[FingerprintCache] = None
+
+    def serves(self, index: str, table_name: str) -> bool:
+        return index == self.index and table_name in NESTED_FIELDS
+
+    def set_state(self, table_name: str, ids: list) -> None:
+        for start in range(0, len(ids), config.BATCH_SIZE):
+            chunk = ids[start:start + config.BATCH_SIZE]
+            names = self._select_names(table_name, chunk)
+            if names:
+                self._update(table_name, names)
+
+    def flush(self) -> None:
+        pass
+
+    @backoff.on_exception(backoff.expo,
+                          CONNECTION_ERRORS,
+                          logger=logger)
+    def _select_names(self, table_name: str, ids: list) -> dict[str, str]:
+        """Read current names, film works of the renamed rows are forgotten by the fingerprint cache"""
+        _, name_field = NESTED_FIELDS[table_name]
+        self.conn = connect(self.conn)
+        with self.conn, self.conn.cursor() as cursor:
+            cursor.execute(SQL.select_names(table_name, name_field), (ids,))
+            names = {str(row_id): name for row_id, name in cursor.fetchall()}
+            if config.FINGERPRINT_CACHE:
+                # documents change behind the loader, their hashes are stale
+                cursor.execute(SQL.select_film_works_from(table_name), (ids,))
+                self._forget([str(row[0]) for row in cursor.fetchall()])
+        return names
+
+    def _forget(self, film_work_ids: list) -> None:
+        if self._fingerprints is None:
+            self._fingerprints = FingerprintCache(config.FINGERPRINT_CACHE)
+        self._fingerprints.forget(self.index, film_work_ids)
+
+    @backoff.on_exception(backoff.expo,
+                          ConnectionError,
+                          logger=logger)
+    def _update(self, table_name: str, names: dict[str, str]) -> None:
+        fields, name_field = NESTED_FIELDS[table_name]
+        # documents loaded within the refresh interval are not matched otherwise
+        self.es.indices.refresh(index=self.index)
+        response = self.es.options(request_timeout=UPDATE_TIMEOUT).update_by_query(
+            index=self.index,
+            query={'bool': {'should': [
+                {'nested': {'path': field, 'query': {'terms': {f'{field}.uuid': list(names)}}}} for field in fields
+            ]}},
+            script={
+                'source': RENAME_SCRIPT,
+                'lang': 'painless',
+                'params': {'fields': list(fields), 'name_field': name_field, 'names': names},
+            },
+            # documents written meanwhile come from batches enriched after the rename
+            conflicts='proceed',
+            slices='auto',
+        )
+        if response.get('failures'):
+            raise PartialUpdateError(f'Failed to rename {table_name} in {self.index}: {response["failures"][:3]}')
+        metrics.PARTIAL_UPDATES.labels(table_name).inc(response.get('updated', 0))
+        logger.info('Renamed %s %s rows in %s documents of %s, %s unchanged',
+                    len(names), table_name, response.get('updated'), self.index, response.get('noops'))
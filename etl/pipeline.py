@@ -0,0 +1,174 @@
+import threading
+from time import monotonic, perf_counter
+from collections import defaultdict
+from dataclasses import dataclass, field
+from queue import Queue, Full
+from typing import Any, Callable, Iterator, Optional
+
+import metrics
+from logger import logger
+from state.models import State
+
+
+STOP = object()
+
+
+class PipelineError(Exception):
+    """Raised in the main thread when one of the stage workers failed"""
+
+
+@dataclass
+class Batch:
+    """Unit of work passed between pipeline stages"""
+    index: str
+    ids: list
+    # (state, key, position) saved once the batch and all previous ones are loaded,
+    # anything with set_state() and flush() methods may stand for the state
+    checkpoints: list[tuple[State, str, Any]] = field(default_factory=list)
+    # (id, version) of documents to delete from the index
+    deleted: list[tuple[Any, Optional[int]]] = field(default_factory=list)
+    seq: int = 0
+    # a stage may split a batch into parts, the last part tells how many there are
+    part: int = 0
+    last_part: bool = True
+    rows: list = field(default_factory=list)
+    models: list = field(default_factory=list)
+
+
+class WatermarkCommitter:
+    """Saves batch checkpoints strictly in the order batches were submitted
+
+    States are flushed when every submitted batch is committed or once per
+    flush interval while the pipeline is busy, so checkpoints of many batches
+    are written to the storage together.
+    """
+
+    def __init__(self, pipeline: 'Pipeline', flush_interval: float):
+        self.pipeline = pipeline
+        self.flush_interval = flush_interval
+        self._next_seq = 1
+        self._loaded_parts = defaultdict(int)
+        self._total_parts = {}
+        self._done = {}
+        self._changed_states = {}
+        self._flushed_at = monotonic()
+
+    def __call__(self, batch: Batch) -> None:
+        self._loaded_parts[batch.seq] += 1
+        if batch.last_part:
+            self._total_parts[batch.seq] = batch.part + 1
+        if self._loaded_parts[batch.seq] == self._total_parts.get(batch.seq):
+            del self._loaded_parts[batch.seq], self._total_parts[batch.seq]
+            self._done[batch.seq] = (batch.index, batch.checkpoints)
+
+        while self._next_seq in self._done:
+            index, checkpoints = self._done.pop(self._next_seq)
+            for state, key, position in checkpoints:
+                logger.info('Updating state: %s - %s', key, position)
+                state.set_state(key, position)
+                metrics.observe_watermark(index, key, position)
+                self._changed_states[id(state)] = state
+            self._next_seq += 1
+
+        idle = self._next_seq > self.pipeline.submitted
+        if self._changed_states and (idle or monotonic() - self._flushed_at >= self.flush_interval):
+            for state in self._changed_states.values():
+                state.flush()
+            self._changed_states.clear()
+            self._flushed_at = monotonic()
+
+
+class Stage:
+    """Pool of worker threads passing batches from an inbox queue to an outbox queue"""
+
+    def __init__(self, pipeline: 'Pipeline', name: str, handler_factory: Callable, workers: int):
+        self.pipeline = pipeline
+        self.name = name
+        self.handler_factory = handler_factory
+        self.inbox = Queue(maxsize=pipeline.queue_size)
+        self.outbox: Optional[Queue] = None
+        self.threads = [
+            threading.Thread(target=self._run, name=f'{name}-{i}', daemon=True) for i in range(workers)
+        ]
+
+    def _run(self) -> None:
+        try:
+            handle = self.handler_factory()
+            # handlers grouping batches pass them on from release() once the inbox runs dry
+            release = getattr(handle, 'release', None)
+            while (batch := self.inbox.get()) is not STOP:
+                self._handle(handle, batch)
+                if release is not None and self.inbox.empty():
+                    self._handle(release)
+            if release is not None:
+                self._handle(release)
+            # let the sibling workers stop too
+            self.inbox.put(STOP)
+        except Exception as exc:
+            logger.exception('Stage %s failed', self.name)
+            self.pipeline.fail(exc)
+
+    def _handle(self, handler: Callable, *args) -> None:
+        started = perf_counter()
+        busy = 0.0
+        result = handler(*args)
+        # handlers splitting or grouping batches return an iterator
+        for item in result if isinstance(result, Iterator) else (result,):
+            busy += perf_counter() - started
+            if self.outbox is not None:
+                self.pipeline.put(self.outbox, item)
+            started = perf_counter()
+        metrics.STAGE_SECONDS.labels(self.name).observe(busy + perf_counter() - started)
+
+
+class Pipeline:
+    """Runs stages concurrently with bounded queues between them"""
+
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self.stages: list[Stage] = []
+        self.submitted = 0
+        self._error: Optional[Exception] = None
+
+    def add_stage(self, name: str, handler_factory: Callable, workers: int = 1) -> None:
+        stage = Stage(self, name, handler_factory, workers)
+        metrics.QUEUE_DEPTH.labels(name).set_function(stage.inbox.qsize)
+        if self.stages:
+            self.stages[-1].outbox = stage.inbox
+        self.stages.append(stage)
+
+    def start(self) -> None:
+        for stage in self.stages:
+            for thread in stage.threads:
+                thread.start()
+
+    def submit(self, batch: Batch) -> None:
+        self.submitted += 1
+        batch.seq = self.submitted
+        metrics.BATCH_SIZE.labels(batch.index).observe(len(batch.ids) + len(batch.deleted))
+        self.put(self.stages[0].inbox, batch)
+
+    def put(self, queue: Queue, item: Any) -> None:
+        """Put an item blocking while the queue is full unless the pipeline has failed"""
+        while True:
+            self.check()
+            try:
+                queue.put(item, timeout=1)
+                return
+            except Full:
+                continue
+
+    def fail(self, exc: Exception) -> None:
+        self._error = exc
+
+    def check(self) -> None:
+        if self._error is not None:
+            raise PipelineError('ETL pipeline stage failed') from self._error
+
+    def stop(self) -> None:
+        """Drain all submitted batches and stop the workers stage by stage"""
+        for stage in self.stages:
+            self.put(stage.inbox, STOP)
+            for thread in stage.threads:
+                thread.join()
+        self.check()
@@ -1,283 +1,113 @@
 import os
-import json
-import backoff
-import psycopg2
-from time import sleep
-from logger import logger
-from typing import Coroutine
-from datetime import datetime
-from dotenv import load_dotenv
-from contextlib import closing
-from elasticsearch import Elasticsearch, ConnectionError, helpers
-
-from sql import SQL
-from decorators import coroutine
-from state.models import State, FilmWork, Person, Genre
-from state.json_file_storage import JsonFileStorage
-from es_index import get_index
-
-
-dotenv_path = os.path.abspath(os.path.dirname(__file__) + '/../config/.env')
-load_dotenv(dotenv_path)
-
-INDICES = {
-    Genre.__name__: 'genre',
-    Person.__name__: 'person',
-    FilmWork.__name__: 'film_work'
-}
+import asyncio
+import argparse
 
-GENRE_TABLE_NAME = 'genre'
-PERSON_TABLE_NAME = 'person'
-FILM_WORK_TABLE_NAME = 'film_work'
+from time import sleep, monotonic
+from elasticsearch import Elasticsearch
+from prometheus_client import start_http_server
 
-TABLE_NAMES = (
-    GENRE_TABLE_NAME,
-    PERSON_TABLE_NAME,
-    FILM_WORK_TABLE_NAME,
+import config
+import distributed
+import async_engine
+from backfill import backfill
+from logger import logger
+from change_capture import ChangeListener, set_change_capture
+from partial_updates import PartialUpdater
+from state.models import State, FilmWork, Person, Genre
+from indices import ensure_index
+from extract import (
+    INDICES, GENRE_TABLE_NAME, PERSON_TABLE_NAME, TABLE_NAMES, Extractor, build_pipeline, get_storage,
+    wait_for_elasticsearch,
 )
 
-def _id_separator(results: list[str, datetime]) -> tuple[list, str]:
-    """Separate list of ids and max datetime"""
-    ids = []
-    modified = []
-    for result in results:
-        ids.append(result[0])
-        modified.append(result[1])
-    last_modified = max(modified)
-    return ids, last_modified
-
-def _actions_generator(models: list):
-    """Yields actions for elasticsearch bulk index helper"""
-    index = INDICES[models[0].__class__.__name__]
-    for model in models:
-        yield {
-            '_index': index,
-            '_id': model.uuid,
-            '_source': model.json(),
-        }
-
-
-@backoff.on_exception(backoff.expo,
-                      psycopg2.OperationalError,
-                      logger=logger)
-@coroutine
-def extract_changed_from(cursor, next_node: Coroutine) -> Coroutine[tuple[str, str], None, None]:
-    """Collect ids of modified rows from a given table"""
-    while True:
-        table_name, last_modified = (yield)
-        logger.info('Looking for changed data for indexing in %s', table_name)
-        cursor.execute(SQL.select_modified_ids(table_name), (last_modified,))
-        while results := cursor.fetchmany(size=500):
-            logger.info('Fetching %s rows from %s changed after %s', len(results), table_name, last_modified)
-            ids, last_modified = _id_separator(results)
-            next_node.send((table_name, last_modified, ids))
-
-
-@backoff.on_exception(backoff.expo,
-                      psycopg2.OperationalError,
-                      logger=logger)
-@coroutine
-def extract_film_works_from_changed(cursor, next_node: Coroutine) -> Coroutine[tuple[str, str, list], None, None]:
-    """ Collect ids of film works corresponded to the modified rows """
-    while True:
-        table_name, last_modified, ids = (yield)
-
-        if table_name == 'film_work':
-            next_node.send((ids, last_modified))
-            state.set_state(table_name, last_modified)
-            continue
-
-        logger.info('Fetching film works related to rows fetched from %s', table_name)
-        sql = SQL.select_film_works_from(table_name)
-        cursor.execute(sql, (tuple(ids),))
-        while results := cursor.fetchmany(size=500):
-            film_work_ids, last_modified_film_works = _id_separator(results)
-            next_node.send((film_work_ids, last_modified_film_works))
-
-        logger.info('Updating state: %s - %s', table_name, last_modified)
-        state.set_state(table_name, last_modified)
-
-
-@backoff.on_exception(backoff.expo,
-                      psycopg2.OperationalError,
-                      logger=logger)
-@coroutine
-def enrich_genres(cursor, next_node: Coroutine) -> Coroutine[tuple[list, str], None, None]:
-    """ Enrich given genres ids with all data available """
-    while True:
-        _, last_modified, genre_ids = (yield)
-        logger.info('Enriching genres')
-        sql = SQL.enrich_genres()
-        cursor.execute(sql, (tuple(genre_ids),))
-        results = cursor.fetchall()
-        next_node.send((results, last_modified))
-
-
-@coroutine
-def transform_genres(next_node: Coroutine) -> Coroutine[tuple[list, str], None, None]:
-    """ Transform genres Postgres entities to the Elasticsearch index format """
-    while True:
-        sql_results, last_modified = (yield)
-        logger.info('Transforming genres data')
-
-        genres = []
-
-        for result in sql_results:
-            genre = Genre(
-                uuid=result[0],
-                name=result[1],
-                description=result[2],
-            )
-            genres.append(genre)
-
-        genre_state.set_state(GENRE_TABLE_NAME, last_modified)
-        next_node.send(genres)
 
+def check_settings() -> None:
+    """Refuse combinations of settings the selected engine would silently ignore"""
+    if config.ENGINE not in ('threads', 'async'):
+        raise RuntimeError(f'Unknown ETL_ENGINE={config.ENGINE}, expected "threads" or "async"')
+    if config.ENGINE == 'async':
+        unsupported = [name for name, enabled in (
+            ('ETL_CHANGE_CAPTURE=notify', config.CHANGE_CAPTURE == 'notify'),
+            ('ETL_PARTIAL_UPDATES', config.PARTIAL_UPDATES),
+            ('ETL_VALIDATE_DOCUMENTS', config.VALIDATE_DOCUMENTS),
+            ('ETL_DISTRIBUTED', config.DISTRIBUTED),
+        ) if enabled]
+        if unsupported:
+            raise RuntimeError(f'ETL_ENGINE=async does not support {", ".join(unsupported)}, use ETL_ENGINE=threads')
+    if config.DISTRIBUTED and config.STATE_STORAGE != 'postgres':
+        raise RuntimeError('Distributed ETL keeps its state in Postgres, set ETL_STATE_STORAGE=postgres')
 
-@coroutine
-def enrich_persons(cursor, next_node: Coroutine) -> Coroutine[tuple[list, str], None, None]:
-    """ Enrich given persons ids with all data available """
-    while True:
-        _, last_modified, person_ids = (yield)
-        logger.info('Enriching persons')
-        sql = SQL.enrich_persons()
-        cursor.execute(sql, (tuple(person_ids),))
-        results = cursor.fetchall()
-        next_node.send((results, last_modified))
 
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Keep Elasticsearch indices in sync with Postgres')
+    parser.add_argument('--backfill', action='store_true',
+                        help='load all rows by several processes before syncing changes')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of backfill processes')
+    args = parser.parse_args()
+    check_settings()
 
-@coroutine
-def transform_persons(next_node: Coroutine) -> Coroutine[tuple[list, str], None, None]:
-    """ Transform persons Postgres entities to the Elasticsearch index format """
-    while True:
-        sql_results, last_modified = (yield)
-        logger.info('Transforming persons data')
-
-        persons = []
-
-        for result in sql_results:
-            person = Person(
-                uuid=result[0],
-                full_name=result[1],
-            )
-            persons.append(person)
-
-        person_state.set_state(PERSON_TABLE_NAME, last_modified)
-        next_node.send(persons)
-
-@backoff.on_exception(backoff.expo,
-                      psycopg2.OperationalError,
-                      logger=logger)
-@coroutine
-def enrich_film_work(cursor, next_node: Coroutine) -> Coroutine[tuple[list, str], None, None]:
-    """ Enrich given film work ids with all data available """
-    while True:
-        film_work_ids, last_modified = (yield)
-        logger.info('Enriching film works')
-        sql = SQL.enrich_film_works()
-        cursor.execute(sql, (tuple(film_work_ids),))
-        results = cursor.fetchall()
-        next_node.send((results, last_modified))
-
-
-@coroutine
-def transform_movies(next_node: Coroutine) -> Coroutine[tuple[list, str], None, None]:
-    """ Transform film work Postgres entities to the Elasticsearch index format """
-    while True:
-        sql_results, last_modified = (yield)
-        logger.info('Transforming film work data')
-
-        film_works = []
-
-        for result in sql_results:
-            film_work = FilmWork(
-                uuid=result[0],
-                title=result[1],
-                description=result[2],
-                imdb_rating=result[3],
-                genre=[Genre(uuid=genre['id'], name=genre['name']) for genre in result[8]],
-            )
-            for person_dict in result[7]:
-                person = Person(uuid=person_dict['id'], full_name=person_dict['name'])
-                if person_dict['role'] == 'director':
-                    film_work.directors.append(person)
-                elif person_dict['role'] == 'actor':
-                    film_work.actors.append(person)
-                elif person_dict['role'] == 'writer':
-                    film_work.writers.append(person)
-            film_works.append(film_work)
-
-        next_node.send(film_works)
-
-
-@backoff.on_exception(backoff.expo,
-                      ConnectionError,
-                      logger=logger)
-@coroutine
-def load_models(es: Elasticsearch) -> Coroutine[list, None, None]:
-    """ Load information about changed models to Elasticsearch """
-    while True:
-        models = (yield)
-        logger.info('Received for loading %s items of model %s', len(models), models[0].__class__.__name__)
-
-        helpers.bulk(es, _actions_generator(models))
-        logger.info('Loading to Elasticsearch complete')
-
+    if config.METRICS_PORT:
+        start_http_server(config.METRICS_PORT, addr=config.METRICS_ADDR)
 
-if __name__ == '__main__':
-    dsn = {
-        'dbname': os.environ.get('DB_NAME'),
-        'user': os.environ.get('DB_USER'),
-        'password': os.environ.get('DB_PASSWORD'),
-        'host': os.environ.get('DB_HOST'),
-        'port': os.environ.get('DB_PORT'),
-        'options': '-c search_path=content',
-    }
-    es = Elasticsearch(f"http://{os.environ.get('ELASTIC_HOST')}:{os.environ.get('ELASTIC_PORT')}")
-    state = State(JsonFileStorage(logger=logger, file_path='film_work_state.json'))
-    genre_state = State(JsonFileStorage(logger=logger, file_path='genre_state.json'))
-    person_state = State(JsonFileStorage(logger=logger, file_path='person_state.json'))
+    es = Elasticsearch(config.ELASTIC_URL)
+    state = State(get_storage('film_work_state'))
+    genre_state = State(get_storage('genre_state'))
+    person_state = State(get_storage('person_state'))
 
-    while not es.ping():
-        logger.info('Waiting for Elasticsearch connection...')
-        sleep(1)
+    wait_for_elasticsearch(es)
 
+    # indices are served by aliases, so they can be rebuilt by reindex.py without downtime
     for cls, name in INDICES.items():
-        response = es.indices.create(
-            index=name,
-            body=get_index(cls),
-            ignore=400,
-        )
-        logger.info('Attempted to create Elasticsearch index. Response: %s', response)
+        ensure_index(es, cls, name)
 
-    with closing(psycopg2.connect(**dsn)) as conn, conn.cursor() as cur:
-        loader_coro = load_models(es)
+    if args.backfill:
+        backfill(args.workers, {
+            INDICES[FilmWork.__name__]: state,
+            INDICES[Genre.__name__]: genre_state,
+            INDICES[Person.__name__]: person_state,
+        })
 
+    sources = [
         # film work etl pipeline
-        transformer_coro = transform_movies(loader_coro)
-        enricher_coro = enrich_film_work(cur, transformer_coro)
-        film_work_ids_extractor_coro = extract_film_works_from_changed(cur, enricher_coro)
-        extractor_coro = extract_changed_from(cur, film_work_ids_extractor_coro)
-
+        *((INDICES[FilmWork.__name__], table_name, state) for table_name in TABLE_NAMES),
         # genres etl pipeline
-        transform_genres_coro = transform_genres(loader_coro)
-        enrich_genres_coro = enrich_genres(cur, transform_genres_coro)
-        genres_extractor_coro = extract_changed_from(cur, enrich_genres_coro)
-
+        (INDICES[Genre.__name__], GENRE_TABLE_NAME, genre_state),
         # persons etl pipeline
-        transform_persons_coro = transform_persons(loader_coro)
-        enrich_persons_coro = enrich_persons(cur, transform_persons_coro)
-        persons_extractor_coro = extract_changed_from(cur, enrich_persons_coro)
+        (INDICES[Person.__name__], PERSON_TABLE_NAME, person_state),
+    ]
 
-        logger.info('Starting ETL process for updates ...')
-        while True:
-            # starting film work etl
-            for table_name in TABLE_NAMES:
-                extractor_coro.send((table_name, state.get_state(table_name) or str(datetime.min)))
+    # the queue is read by the threaded engine of a single instance in notify mode only
+    set_change_capture(config.CHANGE_CAPTURE == 'notify' and config.ENGINE == 'threads' and not config.DISTRIBUTED)
 
-            # starting genres etl
-            genres_extractor_coro.send((GENRE_TABLE_NAME, genre_state.get_state(GENRE_TABLE_NAME) or str(datetime.min)))
+    logger.info('Starting ETL process for updates ...')
+    if config.ENGINE == 'async':
+        asyncio.run(async_engine.run(sources))
 
-            # starting genres etl
-            persons_extractor_coro.send((PERSON_TABLE_NAME, person_state.get_state(PERSON_TABLE_NAME) or str(datetime.min)))
-            sleep(int(os.environ.get('ETL_ITER_PAUSE_TIME')) or 5)
+    # every node would keep its own fingerprints of documents loaded by the others too,
+    # and skip writes the index has not seen
+    pipeline = build_pipeline(es, skip_unchanged=not config.DISTRIBUTED)
+    pipeline.start()
+
+    if config.DISTRIBUTED:
+        distributed.run(pipeline, sources)
+
+    extractor = Extractor(sources, PartialUpdater(es, INDICES[FilmWork.__name__]) if config.PARTIAL_UPDATES else None)
+
+    if config.CHANGE_CAPTURE == 'notify':
+        listener = ChangeListener()
+        polled_at = None
+        while True:
+            listener.wait(timeout=config.POLL_FALLBACK_INTERVAL)
+            extractor.run_queue_cycle(pipeline)
+            extractor.run_tombstone_cycle(pipeline)
+            if polled_at is None or monotonic() - polled_at >= config.POLL_FALLBACK_INTERVAL:
+                extractor.run_cycle(pipeline)
+                polled_at = monotonic()
+            pipeline.check()
+    else:
+        while True:
+            extractor.purge_queue()
+            extractor.run_tombstone_cycle(pipeline)
+            extractor.run_cycle(pipeline)
+            pipeline.check()
+            sleep(config.ITER_PAUSE_TIME)
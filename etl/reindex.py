@@ -0,0 +1,118 @@
+"""Rebuild Elasticsearch indices without downtime
+
+Every index is filled as a new version (film_work_v2, film_work_v3, ...) with
+bulk load settings, then the alias readers use is switched to it atomically.
+Rows changed while the index was filled are copied again after the switch,
+and documents of rows deleted meanwhile are removed from it.
+
+    python reindex.py [--index film_work] [--index genre] [--index person] [--keep-old]
+"""
+import argparse
+from time import time_ns
+from contextlib import closing
+from typing import Optional
+
+from elasticsearch import Elasticsearch, helpers
+
+import config
+from sql import SQL
+from db import connect, database_now
+from loader import Loader
+from logger import logger
+from fingerprints import FingerprintCache
+from indices import create_next_version, current_replicas, finish_bulk_load, swap_alias
+from extract import (
+    INDICES, TABLE_NAMES, FILM_WORK_TABLE_NAME, MIN_UUID, Extractor, build_pipeline, wait_for_elasticsearch,
+)
+from state.models import State
+from state.memory_storage import MemoryStorage
+
+CLASS_NAMES = {alias: class_name for class_name, alias in INDICES.items()}
+
+
+def copy_rows(es: Elasticsearch, alias: str, index: str, tables: list[str], since: Optional[str] = None) -> None:
+    """Load documents built from rows of the given tables modified after `since` into an index"""
+    state = State(MemoryStorage())
+    for table_name in tables:
+        if since:
+            state.set_state(table_name, {'modified': since, 'id': MIN_UUID})
+
+    pipeline = build_pipeline(es, index_names={alias: index})
+    pipeline.start()
+    Extractor([(alias, table_name, state) for table_name in tables]).run_cycle(pipeline)
+    pipeline.stop()
+
+
+def remove_deleted(es: Elasticsearch, alias: str, index: str) -> None:
+    """Delete documents of rows which are gone from the table
+
+    Deletions handled by the running ETL before the alias was switched
+    reached the old index only, and their tombstones are removed already.
+    """
+    deleted = 0
+    ids = []
+    scan = helpers.scan(es, index=index, query={'query': {'match_all': {}}, '_source': False}, size=config.BATCH_SIZE)
+    with closing(connect()) as conn:
+        for hit in scan:
+            ids.append(hit['_id'])
+            if len(ids) < config.BATCH_SIZE:
+                continue
+            deleted += _delete_missing(conn, es, alias, index, ids)
+            ids = []
+        if ids:
+            deleted += _delete_missing(conn, es, alias, index, ids)
+    logger.info('Deleted %s documents of removed rows from %s', deleted, index)
+
+
+def _delete_missing(conn, es: Elasticsearch, alias: str, index: str, ids: list) -> int:
+    with conn, conn.cursor() as cursor:
+        cursor.execute(SQL.select_existing_ids(alias), (ids,))
+        existing = {str(row[0]) for row in cursor.fetchall()}
+    missing = [doc_id for doc_id in ids if doc_id not in existing]
+    if missing:
+        # the rows are gone, so any write of their documents arriving later is stale
+        version = time_ns() // 1000
+        Loader(es).load([
+            {'_op_type': 'delete', '_index': index, '_id': doc_id, 'version': version, 'version_type': 'external_gte'}
+            for doc_id in missing
+        ])
+    return len(missing)
+
+
+def reindex(es: Elasticsearch, alias: str, keep_old: bool) -> None:
+    class_name = CLASS_NAMES[alias]
+    replicas = current_replicas(es, alias)
+    index = create_next_version(es, class_name, alias)
+
+    started = database_now()
+    logger.info('Copying the whole %s table to %s', alias, index)
+    copy_rows(es, alias, index, [alias])
+    finish_bulk_load(es, index, class_name, replicas)
+    old_indices = swap_alias(es, alias, index)
+    if config.FINGERPRINT_CACHE:
+        # remembered hashes describe documents of the old index
+        FingerprintCache(config.FINGERPRINT_CACHE).clear(alias)
+
+    # the running ETL kept writing changes made meanwhile to the old index
+    logger.info('Copying rows changed since %s to %s', started, index)
+    copy_rows(es, alias, index, list(TABLE_NAMES) if alias == FILM_WORK_TABLE_NAME else [alias], since=started)
+    # deletions reach the new index through the alias from now on
+    remove_deleted(es, alias, index)
+
+    if not keep_old:
+        for old_index in old_indices:
+            es.indices.delete(index=old_index)
+            logger.info('Deleted Elasticsearch index %s', old_index)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild Elasticsearch indices and switch aliases to them')
+    parser.add_argument('--index', dest='aliases', action='append', choices=list(CLASS_NAMES),
+                        help='index to rebuild, all indices by default')
+    parser.add_argument('--keep-old', action='store_true', help='do not delete previous index versions')
+    args = parser.parse_args()
+
+    es = Elasticsearch(config.ELASTIC_URL)
+    wait_for_elasticsearch(es)
+    for alias in args.aliases or CLASS_NAMES:
+        reindex(es, alias, args.keep_old)
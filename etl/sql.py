@@ -27,13 +27,14 @@ class SQL:
                            )
                        ) FILTER (WHERE g.id is not null),
                        '[]'
-                   ) as genres
+                   ) as genres,
+                   (extract(epoch FROM GREATEST(fw.modified, max(p.modified), max(g.modified))) * 1000000)::bigint as version
                 FROM content.film_work fw
                 LEFT JOIN content.person_film_work pfw ON pfw.film_work_id = fw.id
                 LEFT JOIN content.person p ON p.id = pfw.person_id
                 LEFT JOIN content.genre_film_work gfw ON gfw.film_work_id = fw.id
                 LEFT JOIN content.genre g ON g.id = gfw.genre_id
-                WHERE fw.id IN %s
+                WHERE fw.id = ANY(%s::uuid[])
                 GROUP BY fw.id
                 ORDER BY fw.modified;"""
 
@@ -41,35 +42,119 @@ class SQL:
     def select_modified_ids(table_name, limit=1000):
         return f"""SELECT id, modified
                    FROM content.{table_name}
-                   WHERE modified > %s
-                   ORDER BY modified
+                   WHERE (modified, id) > (%s::timestamptz, %s::uuid)
+                   ORDER BY modified, id
                    LIMIT {limit}; """
 
 
     @staticmethod
-    def select_film_works_from(table_name, limit=1000):
-        return f"""SELECT fw.id, fw.modified
-                   FROM content.film_work fw
-                   LEFT JOIN content.{table_name}_film_work ON {table_name}_film_work.film_work_id = fw.id
-                   WHERE {table_name}_film_work.{table_name}_id IN %s
-                   ORDER BY fw.modified
+    def select_ids_between(table_name, limit=1000):
+        return f"""SELECT id
+                   FROM content.{table_name}
+                   WHERE id > %s::uuid AND id <= %s::uuid
+                   ORDER BY id
                    LIMIT {limit};"""
 
+    @staticmethod
+    def select_film_works_from(table_name):
+        return f"""SELECT DISTINCT film_work_id
+                   FROM content.{table_name}_film_work
+                   WHERE {table_name}_id = ANY(%s::uuid[]);"""
+
+    @staticmethod
+    def select_existing_ids(table_name):
+        return f"""SELECT id
+                   FROM content.{table_name}
+                   WHERE id = ANY(%s::uuid[]);"""
+
+    @staticmethod
+    def select_names(table_name, column):
+        return f"""SELECT id, {column}
+                   FROM content.{table_name}
+                   WHERE id = ANY(%s::uuid[]);"""
+
     @staticmethod
     def enrich_genres():
         return """SELECT
                   genre.id,
                   genre.name,
-                  genre.description
+                  genre.description,
+                  (extract(epoch FROM genre.modified) * 1000000)::bigint as version
                   FROM content.genre
-                  WHERE genre.id IN %s
+                  WHERE genre.id = ANY(%s::uuid[])
                   ORDER BY genre.modified;"""
 
     @staticmethod
     def enrich_persons():
         return """SELECT
                   person.id,
-                  person.full_name
+                  person.full_name,
+                  (extract(epoch FROM person.modified) * 1000000)::bigint as version
                   FROM content.person
-                  WHERE person.id IN %s
+                  WHERE person.id = ANY(%s::uuid[])
                   ORDER BY person.modified;"""
+
+    @staticmethod
+    def claim_changes():
+        return """DELETE FROM content.etl_change_queue
+                  WHERE id IN (
+                      SELECT id
+                      FROM content.etl_change_queue
+                      ORDER BY id
+                      LIMIT %s
+                      FOR UPDATE SKIP LOCKED
+                  )
+                  RETURNING table_name, row_id;"""
+
+    @staticmethod
+    def set_change_capture():
+        return """UPDATE content.etl_change_capture SET enabled = %s;"""
+
+    @staticmethod
+    def purge_changes():
+        return """DELETE FROM content.etl_change_queue;"""
+
+    @staticmethod
+    def select_tombstones():
+        return """SELECT id, table_name, row_id, (extract(epoch FROM created) * 1000000)::bigint
+                  FROM content.etl_tombstone
+                  WHERE id > %s
+                  ORDER BY id
+                  LIMIT %s;"""
+
+    @staticmethod
+    def delete_tombstones():
+        return """DELETE FROM content.etl_tombstone
+                  WHERE id = ANY(%s::bigint[]);"""
+
+    @staticmethod
+    def try_leadership():
+        return """SELECT pg_try_advisory_lock(hashtext('etl_leader'));"""
+
+    @staticmethod
+    def insert_work():
+        return """INSERT INTO content.etl_work (index_name, ids, deleted, deleted_versions)
+                  VALUES (%s, %s::uuid[], %s::uuid[], %s::bigint[]);"""
+
+    @staticmethod
+    def count_work():
+        return """SELECT count(*) FROM content.etl_work;"""
+
+    @staticmethod
+    def claim_work():
+        return """UPDATE content.etl_work
+                  SET claimed_by = %s, claimed_until = now() + %s * interval '1 second'
+                  WHERE id IN (
+                      SELECT id
+                      FROM content.etl_work
+                      WHERE claimed_until IS NULL OR claimed_until < now()
+                      ORDER BY id
+                      LIMIT %s
+                      FOR UPDATE SKIP LOCKED
+                  )
+                  RETURNING id, index_name, ids::text[], deleted::text[], deleted_versions;"""
+
+    @staticmethod
+    def delete_work():
+        return """DELETE FROM content.etl_work
+                  WHERE id = ANY(%s::bigint[]);"""
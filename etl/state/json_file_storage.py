@@ -1,4 +1,6 @@
+import os
 import json
+import tempfile
 from json import JSONDecodeError
 from logging import Logger
 from typing import Optional
@@ -14,8 +16,25 @@ class JsonFileStorage(BaseStorage):
         self._logger = logger
 
     def save_state(self, state: dict) -> None:
-        with open(self.file_path, 'w') as outfile:
-            json.dump(state, outfile)
+        """Write state to a temporary file and atomically replace the old one"""
+        directory = os.path.dirname(os.path.abspath(self.file_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as outfile:
+                json.dump(state, outfile)
+                outfile.flush()
+                os.fsync(outfile.fileno())
+            os.replace(tmp_path, self.file_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        # persist the rename itself
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
 
     def retrieve_state(self) -> dict:
         try:
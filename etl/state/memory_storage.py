@@ -0,0 +1,14 @@
+from .base_storage import BaseStorage
+
+
+class MemoryStorage(BaseStorage):
+    """Keeps state for one run only"""
+
+    def __init__(self):
+        self._state = dict()
+
+    def save_state(self, state: dict) -> None:
+        self._state = dict(state)
+
+    def retrieve_state(self) -> dict:
+        return dict(self._state)
@@ -1,4 +1,5 @@
 from uuid import UUID
+from threading import Lock
 from typing import Any, List
 from datetime import datetime
 
@@ -8,19 +9,40 @@ from .base_storage import BaseStorage
 
 
 class State:
+    """Caches state in memory, changes reach the storage only on flush()"""
+
     def __init__(self, storage: BaseStorage):
         self.storage = storage
+        self._state = storage.retrieve_state()
+        self._dirty = False
+        self._lock = Lock()
 
     def set_state(self, key: str, value: Any) -> None:
-        try:
-            state = self.storage.retrieve_state()
-        except FileNotFoundError:
-            state = dict()
-        state[key] = str(value)
-        self.storage.save_state(state)
+        with self._lock:
+            self._state[key] = value if isinstance(value, dict) else str(value)
+            self._dirty = True
 
     def get_state(self, key: str) -> Any:
-        return self.storage.retrieve_state().get(key)
+        with self._lock:
+            return self._state.get(key)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._state)
+
+    def flush(self) -> None:
+        """Save all changes made since the previous flush at once"""
+        with self._lock:
+            if not self._dirty:
+                return
+            state = dict(self._state)
+            self._dirty = False
+        try:
+            self.storage.save_state(state)
+        except Exception:
+            with self._lock:
+                self._dirty = True
+            raise
 
 
 class Person(BaseModel):
@@ -0,0 +1,52 @@
+import json
+from logging import Logger
+from typing import Optional
+
+import backoff
+import psycopg2
+
+from .base_storage import BaseStorage
+
+
+class PostgresStorage(BaseStorage):
+    """Keeps state as a jsonb row of the content.etl_state table"""
+
+    def __init__(self, logger: Logger, dsn: dict, name: str):
+        self.dsn = dsn
+        self.name = name
+        self._logger = logger
+        self._conn = None
+
+    @property
+    def conn(self):
+        if self._conn is None or self._conn.closed:
+            self._conn = psycopg2.connect(**self.dsn)
+        return self._conn
+
+    def write(self, cursor, state: dict) -> None:
+        """Write state through a given cursor, so it is committed with the rest of its transaction"""
+        cursor.execute(
+            """INSERT INTO content.etl_state (name, state, modified)
+               VALUES (%s, %s, now())
+               ON CONFLICT (name) DO UPDATE SET state = EXCLUDED.state, modified = EXCLUDED.modified;""",
+            (self.name, json.dumps(state)),
+        )
+
+    @backoff.on_exception(backoff.expo,
+                          (psycopg2.OperationalError, psycopg2.InterfaceError),
+                          max_time=60)
+    def save_state(self, state: dict) -> None:
+        with self.conn, self.conn.cursor() as cursor:
+            self.write(cursor, state)
+
+    @backoff.on_exception(backoff.expo,
+                          (psycopg2.OperationalError, psycopg2.InterfaceError),
+                          max_time=60)
+    def retrieve_state(self) -> dict:
+        with self.conn, self.conn.cursor() as cursor:
+            cursor.execute('SELECT state FROM content.etl_state WHERE name = %s;', (self.name,))
+            row: Optional[tuple] = cursor.fetchone()
+        if row is None:
+            self._logger.warning('No state saved for %s. Continue with empty state', self.name)
+            return dict()
+        return row[0]
@@ -0,0 +1,6 @@
+"""ETL modules import each other by plain names, as when run from the etl directory"""
+import os
+import sys
+
+os.environ.setdefault('ETL_LOGGING_LVL', 'error')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,20 @@
+from uuid import UUID
+
+import pytest
+
+from backfill import MAX_UUID, shard_bounds
+from extract import MIN_UUID
+
+
+@pytest.mark.parametrize('workers', [1, 2, 3, 7, 16])
+def test_shards_cover_uuid_space(workers):
+    bounds = shard_bounds(workers)
+
+    assert len(bounds) == workers
+    # shards select id > after AND id <= up to, so every range starts where the previous one ends
+    assert bounds[0][0] == MIN_UUID
+    assert bounds[-1][1] == MAX_UUID
+    for (_, upto), (after, _) in zip(bounds, bounds[1:]):
+        assert after == upto
+    for after, upto in bounds:
+        assert UUID(after) < UUID(upto)
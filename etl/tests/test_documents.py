@@ -0,0 +1,39 @@
+import uuid
+
+import pytest
+
+import config
+from pipeline import Batch
+from extract import transform
+
+
+def _film_work_row(number: int) -> tuple:
+    persons = [
+        {'id': str(uuid.uuid4()), 'name': f'Person {number} {role}', 'role': role}
+        for role in ('actor', 'writer', 'director', 'actor', 'producer')
+    ]
+    genres = [{'id': str(uuid.uuid4()), 'name': f'Genre {genre}'} for genre in range(3)]
+    return (str(uuid.uuid4()), f'Title {number}', '' if number % 2 else 'Description', number / 2, 'movie',
+            None, None, persons, genres, 1_700_000_000_000_000 + number)
+
+
+ROWS = {
+    'film_work': [_film_work_row(number) for number in range(10)],
+    'genre': [(str(uuid.uuid4()), f'Genre {number}', 'Description', 1_700_000_000_000_000) for number in range(10)],
+    'person': [(str(uuid.uuid4()), f'Person {number}', 1_700_000_000_000_000) for number in range(10)],
+}
+
+
+def _documents(index: str, validate: bool, monkeypatch) -> list:
+    monkeypatch.setattr(config, 'VALIDATE_DOCUMENTS', validate)
+    batch = transform(Batch(index, [], rows=list(ROWS[index])))
+    return [(str(document.uuid), document.source, document.version) for document in batch.models]
+
+
+@pytest.mark.parametrize('index', ROWS)
+def test_fast_documents_match_validated(index, monkeypatch):
+    fast = _documents(index, False, monkeypatch)
+    validated = _documents(index, True, monkeypatch)
+
+    assert len(fast) == len(ROWS[index])
+    assert fast == validated
@@ -0,0 +1,57 @@
+import pytest
+
+from documents import Document
+from fingerprints import FingerprintCache, fingerprint
+from loader import Loader
+from pipeline import Batch
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return FingerprintCache(str(tmp_path / 'fingerprints.sqlite'))
+
+
+class RecordingLoader(Loader):
+    """Records ids of sent actions instead of calling Elasticsearch"""
+
+    def __init__(self, fingerprints: FingerprintCache, dropped: set = frozenset()):
+        super().__init__(None, fingerprints=fingerprints)
+        self.sent = []
+        self.dropped = dropped
+
+    def load(self, actions: list[dict]) -> set[str]:
+        self.sent.append(sorted(action['_id'] for action in actions))
+        return set(self.dropped)
+
+    def run(self, documents: dict[str, bytes], deleted: list = ()) -> list[str]:
+        batch = Batch('movies', [], deleted=list(deleted))
+        batch.models = [Document(doc_id, source) for doc_id, source in documents.items()]
+        list(self(batch))
+        list(self.release())
+        return self.sent.pop()
+
+
+def test_unchanged_finds_equal_digests_only(cache):
+    cache.remember('movies', {'a': fingerprint(b'a'), 'b': fingerprint(b'b')})
+
+    unchanged = cache.unchanged('movies', {'a': fingerprint(b'a'), 'b': fingerprint(b'changed'), 'c': fingerprint(b'c')})
+
+    assert unchanged == {'a'}
+    assert cache.unchanged('genre', {'a': fingerprint(b'a')}) == set()
+
+
+def test_loader_skips_unchanged_documents(cache):
+    es_loader = RecordingLoader(cache)
+
+    assert es_loader.run({'a': b'a', 'b': b'b'}) == ['a', 'b']
+    assert es_loader.run({'a': b'a', 'b': b'changed'}) == ['b']
+    assert es_loader.run({'a': b'a', 'b': b'changed'}) == []
+
+
+def test_loader_forgets_deleted_and_dropped_documents(cache):
+    RecordingLoader(cache).run({'a': b'a', 'b': b'b'})
+
+    assert RecordingLoader(cache).run({}, deleted=[('a', 1)]) == ['a']
+    assert RecordingLoader(cache, dropped={'c'}).run({'c': b'c'}) == ['c']
+
+    assert cache.unchanged('movies', {'a': fingerprint(b'a'), 'b': fingerprint(b'b'), 'c': fingerprint(b'c')}) == {'b'}
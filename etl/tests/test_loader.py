@@ -0,0 +1,79 @@
+import pytest
+
+import config
+import loader
+from documents import Document
+from loader import Loader, _actions_generator
+
+
+def _item(op_type: str, doc_id: str, status: int) -> tuple[bool, dict]:
+    return status < 300, {op_type: {'_index': 'movies', '_id': doc_id, 'status': status, 'error': 'error'}}
+
+
+@pytest.fixture
+def bulk_results(monkeypatch):
+    """Answer every bulk request with the next list of (op_type, id, status)"""
+    responses = []
+
+    def streaming_bulk(es, actions, **kwargs):
+        actions = list(actions)
+        return [_item(*result) for result in responses.pop(0) if any(action['_id'] == result[1] for action in actions)]
+
+    monkeypatch.setattr(config, 'BULK_THREADS', 1)
+    monkeypatch.setattr(loader.helpers, 'streaming_bulk', streaming_bulk)
+    monkeypatch.setattr(loader, 'sleep', lambda seconds: None)
+    return responses
+
+
+def _actions(*ids: str) -> list[dict]:
+    return [{'_index': 'movies', '_id': doc_id, '_source': b'{}'} for doc_id in ids]
+
+
+def test_send_classifies_results(bulk_results):
+    bulk_results.append([
+        ('index', 'ok', 201),
+        ('index', 'rejected', 429),
+        ('index', 'unavailable', 503),
+        ('delete', 'missing', 404),
+        ('index', 'stale', 409),
+        ('index', 'invalid', 400),
+    ])
+    actions = _actions('ok', 'rejected', 'unavailable', 'stale', 'invalid')
+    actions.append({'_op_type': 'delete', '_index': 'movies', '_id': 'missing'})
+
+    failed, rejected, failed_for_good, stale = Loader(None)._send(actions)
+
+    assert [action['_id'] for action in failed] == ['rejected', 'unavailable']
+    assert rejected == 1
+    assert failed_for_good == ['invalid']
+    assert stale == ['stale']
+
+
+def test_load_retries_temporary_failures(bulk_results):
+    bulk_results.extend([
+        [('index', 'a', 201), ('index', 'b', 429), ('index', 'c', 409)],
+        [('index', 'b', 502)],
+        [('index', 'b', 201)],
+    ])
+    es_loader = Loader(None)
+
+    dropped = es_loader.load(_actions('a', 'b', 'c'))
+
+    assert dropped == {'c'}
+    assert bulk_results == []
+    assert es_loader.throttle > 0
+
+
+def test_actions_carry_versions():
+    documents = [Document('a', b'{"uuid": "a"}', 1_700_000_000_000_000), Document('b', b'{"uuid": "b"}')]
+
+    actions = list(_actions_generator('movies', documents, [('c', 1_700_000_000_000_001), ('d', None)]))
+
+    assert actions == [
+        {'_index': 'movies', '_id': 'a', '_source': b'{"uuid": "a"}',
+         'version': 1_700_000_000_000_000, 'version_type': 'external_gte'},
+        {'_index': 'movies', '_id': 'b', '_source': b'{"uuid": "b"}'},
+        {'_op_type': 'delete', '_index': 'movies', '_id': 'c',
+         'version': 1_700_000_000_000_001, 'version_type': 'external_gte'},
+        {'_op_type': 'delete', '_index': 'movies', '_id': 'd'},
+    ]
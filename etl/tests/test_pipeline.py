@@ -0,0 +1,39 @@
+from dataclasses import replace
+from types import SimpleNamespace
+
+from pipeline import Batch, WatermarkCommitter
+
+
+class RecordingState:
+    def __init__(self):
+        self.positions = []
+        self.flushes = 0
+
+    def set_state(self, key, position):
+        self.positions.append((key, position))
+
+    def flush(self):
+        self.flushes += 1
+
+
+def _parts(batch: Batch, count: int) -> list[Batch]:
+    return [replace(batch, part=part, last_part=part == count - 1) for part in range(count)]
+
+
+def test_checkpoints_are_saved_in_submission_order():
+    state = RecordingState()
+    batches = [Batch('movies', [seq], [(state, 'film_work', seq)], seq=seq) for seq in range(1, 4)]
+    first, second, third = (_parts(batch, 2) for batch in batches)
+    committer = WatermarkCommitter(SimpleNamespace(submitted=3), flush_interval=60)
+
+    # the last part comes before the first one, later batches before earlier ones
+    for part in (third[1], second[0], third[0], first[1]):
+        committer(part)
+        assert state.positions == []
+
+    committer(second[1])
+    assert state.positions == []
+
+    committer(first[0])
+    assert state.positions == [('film_work', 1), ('film_work', 2), ('film_work', 3)]
+    assert state.flushes == 1
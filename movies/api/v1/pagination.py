@@ -0,0 +1,34 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class FilmworkCursorPagination(CursorPagination):
+    """Walks film works in the order of the primary key without counting them
+
+    CursorPagination filters by the first ordering field only and skips rows
+    sharing its value by OFFSET, so the field must be unique. modified is not:
+    triggers and bulk loads give many rows the same time, and it changes while
+    a crawler walks the pages. The primary key is unique and never changes.
+    """
+    ordering = ('id',)
+
+
+class FilmworkPagination(PageNumberPagination):
+    """Page numbers by default, cursors with ?pagination=cursor
+
+    Page numbers need COUNT(*) and OFFSET, so deep pages get slower, while
+    every cursor page costs the same.
+    """
+    mode_query_param = 'pagination'
+    cursor = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if request.query_params.get(self.mode_query_param) == 'cursor' or \
+                FilmworkCursorPagination.cursor_query_param in request.query_params:
+            self.cursor = FilmworkCursorPagination()
+            return self.cursor.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor:
+            return self.cursor.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -1,6 +1,6 @@
-from rest_framework.serializers import ModelSerializer, CharField, ListField
+from rest_framework.serializers import ModelSerializer, SerializerMethodField
 
-from movies.models import Filmwork, Genre
+from movies.models import Filmwork, Genre, PersonFilmwork
 
 
 class GenreSerializer(ModelSerializer):
@@ -11,9 +11,9 @@ class GenreSerializer(ModelSerializer):
 
 class FilmworkSerializer(ModelSerializer):
     genres = GenreSerializer(many=True, read_only=True)
-    actors = ListField(child=CharField())
-    directors = ListField(child=CharField())
-    writers = ListField(child=CharField())
+    actors = SerializerMethodField()
+    directors = SerializerMethodField()
+    writers = SerializerMethodField()
 
     class Meta:
         model = Filmwork
@@ -29,3 +29,17 @@ class FilmworkSerializer(ModelSerializer):
             'directors',
             'writers',
         )
+
+    @staticmethod
+    def _names(film_work, role):
+        # roles: [{'role': ..., 'name': ...}] из аннотации FilmworkViewSet.queryset
+        return [person['name'] for person in film_work.roles if person['role'] == role]
+
+    def get_actors(self, film_work):
+        return self._names(film_work, PersonFilmwork.Role.actor)
+
+    def get_directors(self, film_work):
+        return self._names(film_work, PersonFilmwork.Role.director)
+
+    def get_writers(self, film_work):
+        return self._names(film_work, PersonFilmwork.Role.writer)
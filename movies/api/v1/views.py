@@ -1,19 +1,64 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
-from django.contrib.postgres.aggregates import ArrayAgg
-from django.db.models import Q
+from django.contrib.postgres.expressions import ArraySubquery
+from django.db.models import OuterRef
+from django.db.models.functions import JSONObject
 
+from movies.cache import get_modified, response_etag, response_key
 from movies.models import Filmwork, PersonFilmwork
+from .pagination import FilmworkPagination
 from .serializers import FilmworkSerializer
 
 
-class FilmworkViewSet(ModelViewSet):
+# Валидаторы считаются по версии каталога без запросов к базе, при совпадении сразу отдается 304.
+conditional = method_decorator(condition(
+    etag_func=lambda request, *args, **kwargs: response_etag(request),
+    last_modified_func=lambda request, *args, **kwargs: get_modified(),
+))
+
+
+class CachedResponseMixin:
+    """Отдает сериализованные ответы из кэша, ключ включает версию каталога и параметры запроса."""
+
+    @conditional
+    def list(self, request, *args, **kwargs):
+        return self.cached(request, super().list, *args, **kwargs)
+
+    @conditional
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached(request, super().retrieve, *args, **kwargs)
+
+    def cached(self, request, handler, *args, **kwargs):
+        key = response_key(request)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, timeout=settings.MOVIES_CACHE_TIMEOUT)
+        return response
+
+
+class FilmworkViewSet(CachedResponseMixin, ModelViewSet):
+    # Роли собираются одним подзапросом на кинопроизведение, без GROUP BY по всем связям.
     queryset = Filmwork.objects.prefetch_related(
-        'genres', 'persons'
+        'genres',
     ).annotate(
-        actors=ArrayAgg('persons__full_name', filter=Q(personfilmwork__role=PersonFilmwork.Role.actor)),
-        directors=ArrayAgg('persons__full_name', filter=Q(personfilmwork__role=PersonFilmwork.Role.director)),
-        writers=ArrayAgg('persons__full_name', filter=Q(personfilmwork__role=PersonFilmwork.Role.writer)),
+        roles=ArraySubquery(
+            PersonFilmwork.objects.filter(
+                film_work=OuterRef('pk'),
+            ).order_by(
+                'person__full_name',
+            ).values(
+                json=JSONObject(role='role', name='person__full_name'),
+            )
+        ),
     ).all()
 
     serializer_class = FilmworkSerializer
+    pagination_class = FilmworkPagination
     http_method_names = ['get', ]
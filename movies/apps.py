@@ -5,3 +5,7 @@ class MoviesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'movies'
     verbose_name = 'Кино'
+
+    def ready(self):
+        # Сигналы сбрасывают кэш ответов API при изменении каталога.
+        from . import signals  # noqa: F401
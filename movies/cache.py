@@ -0,0 +1,56 @@
+from hashlib import blake2b
+from time import time_ns
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+VERSION_KEY = 'movies:version'
+MODIFIED_KEY = 'movies:modified'
+
+
+def _new_version() -> int:
+    # версия после истечения ключа не совпадает ни с одной из прежних
+    return time_ns() // 1000
+
+
+def get_version() -> int:
+    """Номер версии каталога, меняется при каждом изменении кино, жанров и персон.
+
+    Изменения в обход сигналов (bulk_create, SQL, ETL) сигналы не видят, поэтому
+    версия живет не дольше ответов в кэше и валидаторы тоже устаревают не дольше.
+    """
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # add() не перезапишет версию, которую успел сохранить другой процесс
+        cache.add(VERSION_KEY, _new_version(), timeout=settings.MOVIES_CACHE_TIMEOUT)
+        version = cache.get(VERSION_KEY, 0)
+    return version
+
+
+def get_modified():
+    """Время последнего изменения каталога, после истечения ключа - время его создания."""
+    modified = cache.get(MODIFIED_KEY)
+    if modified is None:
+        cache.add(MODIFIED_KEY, timezone.now(), timeout=settings.MOVIES_CACHE_TIMEOUT)
+        modified = cache.get(MODIFIED_KEY, timezone.now())
+    return modified
+
+
+def bump_version() -> None:
+    """Делает недействительными все закэшированные ответы."""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, _new_version(), timeout=settings.MOVIES_CACHE_TIMEOUT)
+    cache.set(MODIFIED_KEY, timezone.now(), timeout=settings.MOVIES_CACHE_TIMEOUT)
+
+
+def response_key(request) -> str:
+    return f'movies:{get_version()}:{request.get_full_path()}'
+
+
+def response_etag(request) -> str:
+    # разные форматы одного ответа (JSON, browsable API) получают разные ETag
+    key = f'{response_key(request)}:{request.META.get("HTTP_ACCEPT", "")}'
+    return blake2b(key.encode(), digest_size=8).hexdigest()
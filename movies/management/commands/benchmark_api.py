@@ -0,0 +1,61 @@
+import json
+from statistics import median, quantiles
+from time import perf_counter
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.settings import api_settings
+
+from movies.models import Filmwork
+
+
+class Command(BaseCommand):
+    help = 'Measures latency and number of queries of the movies API on the current database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help='requests per endpoint')
+        parser.add_argument('--page', type=int, default=None, help='page number to request, the last one by default')
+
+    def measure(self, client, path, requests):
+        timings = []
+        queries = 0
+        for _ in range(requests):
+            # измеряются запросы к базе, а не ответы из кэша
+            cache.clear()
+            with CaptureQueriesContext(connection) as context:
+                started = perf_counter()
+                response = client.get(path)
+                timings.append((perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                raise RuntimeError(f'{path} answered {response.status_code}')
+            queries = len(context.captured_queries)
+        return {
+            'path': path,
+            'queries': queries,
+            'median_ms': round(median(timings), 2),
+            'p95_ms': round(quantiles(timings, n=20)[-1], 2) if len(timings) > 1 else round(timings[0], 2),
+        }
+
+    def handle(self, *args, **options):
+        client = Client()
+        film_works = Filmwork.objects.count()
+        last_page = max(1, -(-film_works // api_settings.PAGE_SIZE))
+        film_work_id = Filmwork.objects.values_list('id', flat=True).order_by('modified').first()
+
+        paths = [
+            '/api/v1/movies/',
+            f'/api/v1/movies/?page={options["page"] or last_page}',
+            '/api/v1/movies/?pagination=cursor',
+        ]
+        if film_work_id:
+            paths.append(f'/api/v1/movies/{film_work_id}/')
+        # the test client calls itself testserver
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            report = {
+                'film_works': film_works,
+                'endpoints': [self.measure(client, path, options['requests']) for path in paths],
+            }
+        self.stdout.write(json.dumps(report, indent=2))
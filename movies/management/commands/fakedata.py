@@ -1,36 +1,94 @@
 import random
+from multiprocessing import get_context
 
 from django.core.management.base import BaseCommand
+from django.db import connections
 from faker import Faker
 
+from movies.cache import bump_version
 from movies.models import Filmwork, Genre, Person, GenreFilmwork, PersonFilmwork
 
 
+def create_film_works(count: int, genre_ids: list, person_ids: list, batch_size: int, seed: int) -> int:
+    """Create film works with one genre, one director and five actors or writers each"""
+    fake = Faker()
+    fake.seed_instance(seed)
+    rand = random.Random(seed)
+    created = 0
+    while created < count:
+        size = min(batch_size, count - created)
+        film_works = Filmwork.objects.bulk_create([
+            Filmwork(
+                title=fake.sentence(nb_words=3),
+                description=fake.sentence(nb_words=20),
+                creation_date=fake.date(),
+                rating=rand.randint(0, 9),
+                type=rand.choice(['movie', 'tv_show']),
+            )
+            for _ in range(size)
+        ])
+        GenreFilmwork.objects.bulk_create(
+            [GenreFilmwork(film_work_id=film_work.id, genre_id=rand.choice(genre_ids)) for film_work in film_works],
+            ignore_conflicts=True,
+        )
+        PersonFilmwork.objects.bulk_create(
+            [
+                PersonFilmwork(film_work_id=film_work.id, person_id=person_id, role=role)
+                for film_work in film_works
+                for person_id, role in zip(
+                    rand.sample(person_ids, min(6, len(person_ids))),
+                    ['director', *(rand.choice(['actor', 'writer']) for _ in range(5))],
+                )
+            ],
+            ignore_conflicts=True,
+        )
+        created += size
+    return created
+
+
 class Command(BaseCommand):
-    help = 'Populates database with 100 film works.'
+    help = 'Populates database with film works, persons and genres.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--films', type=int, default=100)
+        parser.add_argument('--persons', type=int, default=50)
+        parser.add_argument('--genres', type=int, default=7)
+        parser.add_argument('--batch-size', type=int, default=1000, help='rows inserted per query')
+        parser.add_argument('--seed', type=int, default=None, help='make generated data reproducible')
+        parser.add_argument('--workers', type=int, default=1, help='processes creating film works')
 
     def handle(self, *args, **options):
+        seed = options['seed'] if options['seed'] is not None else random.randrange(2 ** 32)
+        batch_size = options['batch_size']
         fake = Faker()
-        genres = Genre.objects.bulk_create([Genre(name=fake.word(), description=fake.text()) for _ in range(7)])
-        persons = Person.objects.bulk_create([Person(full_name=fake.name()) for _ in range(50)])
-        for i in range(100):
-            film_work = Filmwork(
-                    title=fake.sentence(nb_words=3),
-                    description=fake.sentence(nb_words=20),
-                    creation_date=fake.date(),
-                    rating=fake.random_digit(),
-                    type=fake.random_element(elements=['movie', 'tv_show']),
-            )
-            film_work.save()
-            for _ in range(1):
-                film_work.genres.add(genres[random.randint(0, len(genres)-1)], through_defaults={})
-            film_work.persons.add(
-                persons[random.randint(0, len(persons) - 1)],
-                through_defaults={'role': 'director'},
-            )
-            for _ in range(5):
-                film_work.persons.add(
-                    persons[random.randint(0, len(persons)-1)],
-                    through_defaults={'role': fake.random_element(elements=['actor', 'writer'])},
-                )
-            self.stdout.write(self.style.SUCCESS(f'{i+1} of 100'))
+        fake.seed_instance(seed)
+
+        genres = Genre.objects.bulk_create(
+            [Genre(name=fake.word(), description=fake.text()) for _ in range(options['genres'])],
+            batch_size=batch_size,
+        )
+        persons = Person.objects.bulk_create(
+            [Person(full_name=fake.name()) for _ in range(options['persons'])],
+            batch_size=batch_size,
+        )
+        self.stdout.write(self.style.SUCCESS(f'{len(genres)} genres and {len(persons)} persons created'))
+
+        genre_ids = [genre.id for genre in genres]
+        person_ids = [person.id for person in persons]
+        workers = max(1, min(options['workers'], options['films']))
+        # every worker gets its own share of film works and its own seed
+        shares = [
+            (options['films'] // workers + (worker < options['films'] % workers),
+             genre_ids, person_ids, batch_size, seed + worker)
+            for worker in range(workers)
+        ]
+        if workers == 1:
+            created = create_film_works(*shares[0])
+        else:
+            # forked processes must not share the connection of the parent
+            connections.close_all()
+            with get_context('fork').Pool(workers) as pool:
+                created = sum(pool.starmap(create_film_works, shares))
+        # bulk_create sends no signals, so cached API responses are invalidated explicitly
+        bump_version()
+        self.stdout.write(self.style.SUCCESS(f'{created} film works created with seed {seed}'))
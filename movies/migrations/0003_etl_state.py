@@ -0,0 +1,20 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0002_modified_id_indexes'),
+    ]
+
+    operations = [
+        # Состояние ETL хранится рядом с данными, чтобы сохранять его в одной транзакции с ними.
+        migrations.RunSQL(
+            sql="""CREATE TABLE IF NOT EXISTS content.etl_state (
+                       name text PRIMARY KEY,
+                       state jsonb NOT NULL,
+                       modified timestamp with time zone NOT NULL DEFAULT now()
+                   );""",
+            reverse_sql='DROP TABLE IF EXISTS content.etl_state;',
+        ),
+    ]
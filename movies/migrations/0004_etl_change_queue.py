@@ -0,0 +1,65 @@
+from django.db import migrations
+
+
+CONTENT_TABLES = ('film_work', 'genre', 'person')
+RELATION_TABLES = ('genre_film_work', 'person_film_work')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0003_etl_state'),
+    ]
+
+    operations = [
+        # Очередь изменений для ETL: строки добавляются триггерами и удаляются ETL после чтения.
+        migrations.RunSQL(
+            sql="""CREATE TABLE IF NOT EXISTS content.etl_change_queue (
+                       id bigserial PRIMARY KEY,
+                       table_name text NOT NULL,
+                       row_id uuid NOT NULL,
+                       created timestamp with time zone NOT NULL DEFAULT now()
+                   );""",
+            reverse_sql='DROP TABLE IF EXISTS content.etl_change_queue;',
+        ),
+        migrations.RunSQL(
+            sql="""CREATE OR REPLACE FUNCTION content.etl_enqueue_change() RETURNS trigger AS $$
+                   BEGIN
+                       INSERT INTO content.etl_change_queue (table_name, row_id) VALUES (TG_TABLE_NAME, NEW.id);
+                       PERFORM pg_notify('etl_changes', TG_TABLE_NAME);
+                       RETURN NULL;
+                   END;
+                   $$ LANGUAGE plpgsql;""",
+            reverse_sql='DROP FUNCTION IF EXISTS content.etl_enqueue_change();',
+        ),
+        # Изменение связей обновляет modified у кинопроизведения,
+        # поэтому его видят и очередь, и опрос по modified.
+        migrations.RunSQL(
+            sql="""CREATE OR REPLACE FUNCTION content.etl_touch_film_work() RETURNS trigger AS $$
+                   BEGIN
+                       UPDATE content.film_work SET modified = now()
+                       WHERE id = CASE WHEN TG_OP = 'DELETE' THEN OLD.film_work_id ELSE NEW.film_work_id END;
+                       RETURN NULL;
+                   END;
+                   $$ LANGUAGE plpgsql;""",
+            reverse_sql='DROP FUNCTION IF EXISTS content.etl_touch_film_work();',
+        ),
+        *(
+            migrations.RunSQL(
+                sql=f"""CREATE TRIGGER etl_enqueue_change
+                        AFTER INSERT OR UPDATE ON content.{table}
+                        FOR EACH ROW EXECUTE FUNCTION content.etl_enqueue_change();""",
+                reverse_sql=f'DROP TRIGGER IF EXISTS etl_enqueue_change ON content.{table};',
+            )
+            for table in CONTENT_TABLES
+        ),
+        *(
+            migrations.RunSQL(
+                sql=f"""CREATE TRIGGER etl_touch_film_work
+                        AFTER INSERT OR UPDATE OR DELETE ON content.{table}
+                        FOR EACH ROW EXECUTE FUNCTION content.etl_touch_film_work();""",
+                reverse_sql=f'DROP TRIGGER IF EXISTS etl_touch_film_work ON content.{table};',
+            )
+            for table in RELATION_TABLES
+        ),
+    ]
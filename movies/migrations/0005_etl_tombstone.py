@@ -0,0 +1,43 @@
+from django.db import migrations
+
+
+CONTENT_TABLES = ('film_work', 'genre', 'person')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0004_etl_change_queue'),
+    ]
+
+    operations = [
+        # Удалённые строки, которые ETL должен удалить из индексов Elasticsearch.
+        migrations.RunSQL(
+            sql="""CREATE TABLE IF NOT EXISTS content.etl_tombstone (
+                       id bigserial PRIMARY KEY,
+                       table_name text NOT NULL,
+                       row_id uuid NOT NULL,
+                       created timestamp with time zone NOT NULL DEFAULT now()
+                   );""",
+            reverse_sql='DROP TABLE IF EXISTS content.etl_tombstone;',
+        ),
+        migrations.RunSQL(
+            sql="""CREATE OR REPLACE FUNCTION content.etl_record_tombstone() RETURNS trigger AS $$
+                   BEGIN
+                       INSERT INTO content.etl_tombstone (table_name, row_id) VALUES (TG_TABLE_NAME, OLD.id);
+                       PERFORM pg_notify('etl_changes', TG_TABLE_NAME);
+                       RETURN NULL;
+                   END;
+                   $$ LANGUAGE plpgsql;""",
+            reverse_sql='DROP FUNCTION IF EXISTS content.etl_record_tombstone();',
+        ),
+        *(
+            migrations.RunSQL(
+                sql=f"""CREATE TRIGGER etl_record_tombstone
+                        AFTER DELETE ON content.{table}
+                        FOR EACH ROW EXECUTE FUNCTION content.etl_record_tombstone();""",
+                reverse_sql=f'DROP TRIGGER IF EXISTS etl_record_tombstone ON content.{table};',
+            )
+            for table in CONTENT_TABLES
+        ),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0005_etl_tombstone'),
+    ]
+
+    operations = [
+        # Пачки идентификаторов, которые ведущий экземпляр ETL раздаёт остальным.
+        # Взятая пачка закреплена за узлом до claimed_until, после этого её может забрать другой узел.
+        migrations.RunSQL(
+            sql="""CREATE TABLE IF NOT EXISTS content.etl_work (
+                       id bigserial PRIMARY KEY,
+                       index_name text NOT NULL,
+                       ids uuid[] NOT NULL,
+                       deleted uuid[] NOT NULL DEFAULT '{}',
+                       claimed_by text,
+                       claimed_until timestamp with time zone,
+                       created timestamp with time zone NOT NULL DEFAULT now()
+                   );""",
+            reverse_sql='DROP TABLE IF EXISTS content.etl_work;',
+        ),
+    ]
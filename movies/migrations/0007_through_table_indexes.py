@@ -0,0 +1,36 @@
+import django.db.models.deletion
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Индексы строятся без блокировки таблиц, что невозможно внутри транзакции.
+    atomic = False
+
+    dependencies = [
+        ('movies', '0006_etl_work'),
+    ]
+
+    operations = [
+        # ETL ищет кинопроизведения изменённых жанров и персон по genre_id и person_id,
+        # film_work_id в индексе позволяет обойтись без чтения таблицы.
+        # Составные индексы заменяют индексы внешних ключей, которые создал Django.
+        AddIndexConcurrently(
+            model_name='genrefilmwork',
+            index=models.Index(fields=['genre', 'film_work'], name='genre_film_work_genre_fw_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='personfilmwork',
+            index=models.Index(fields=['person', 'film_work'], name='person_film_work_person_fw_idx'),
+        ),
+        migrations.AlterField(
+            model_name='genrefilmwork',
+            name='genre',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='movies.genre'),
+        ),
+        migrations.AlterField(
+            model_name='personfilmwork',
+            name='person',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='movies.person'),
+        ),
+    ]
@@ -0,0 +1,133 @@
+from django.db import migrations
+
+
+CONTENT_TABLES = ('film_work', 'genre', 'person')
+RELATION_TABLES = ('genre_film_work', 'person_film_work')
+
+# Переходные таблицы нельзя объявить у триггера на несколько событий, поэтому триггер на каждое событие.
+ENQUEUE_TRIGGERS = {
+    'etl_enqueue_insert': ('INSERT', 'NEW TABLE AS changed_rows'),
+    'etl_enqueue_update': ('UPDATE', 'NEW TABLE AS changed_rows'),
+}
+TOUCH_TRIGGERS = {
+    'etl_touch_insert': ('INSERT', 'NEW TABLE AS new_links'),
+    'etl_touch_update': ('UPDATE', 'OLD TABLE AS old_links NEW TABLE AS new_links'),
+    'etl_touch_delete': ('DELETE', 'OLD TABLE AS old_links'),
+}
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0007_through_table_indexes'),
+    ]
+
+    operations = [
+        # Очередь изменений заполняется, только пока ETL читает её в режиме notify.
+        migrations.RunSQL(
+            sql="""CREATE TABLE IF NOT EXISTS content.etl_change_capture (
+                       id smallint PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+                       enabled boolean NOT NULL DEFAULT false
+                   );
+                   INSERT INTO content.etl_change_capture (id) VALUES (1) ON CONFLICT DO NOTHING;""",
+            reverse_sql='DROP TABLE IF EXISTS content.etl_change_capture;',
+        ),
+        # Одна вставка в очередь и одно уведомление на запрос, а не на каждую строку.
+        migrations.RunSQL(
+            sql="""CREATE OR REPLACE FUNCTION content.etl_enqueue_changes() RETURNS trigger AS $$
+                   BEGIN
+                       IF EXISTS (SELECT 1 FROM content.etl_change_capture WHERE enabled) THEN
+                           INSERT INTO content.etl_change_queue (table_name, row_id)
+                           SELECT TG_TABLE_NAME, id FROM changed_rows;
+                           IF FOUND THEN
+                               PERFORM pg_notify('etl_changes', TG_TABLE_NAME);
+                           END IF;
+                       END IF;
+                       RETURN NULL;
+                   END;
+                   $$ LANGUAGE plpgsql;""",
+            reverse_sql='DROP FUNCTION IF EXISTS content.etl_enqueue_changes();',
+        ),
+        # Каждое кинопроизведение обновляется один раз на запрос к связям.
+        # clock_timestamp(), а не now(): время начала транзакции может оказаться меньше
+        # modified, который Django только что записал в той же транзакции.
+        migrations.RunSQL(
+            sql="""CREATE OR REPLACE FUNCTION content.etl_touch_film_works() RETURNS trigger AS $$
+                   DECLARE
+                       film_work_ids uuid[] := '{}';
+                   BEGIN
+                       IF TG_OP <> 'DELETE' THEN
+                           film_work_ids := film_work_ids || ARRAY(SELECT film_work_id FROM new_links);
+                       END IF;
+                       IF TG_OP <> 'INSERT' THEN
+                           film_work_ids := film_work_ids || ARRAY(SELECT film_work_id FROM old_links);
+                       END IF;
+                       UPDATE content.film_work SET modified = GREATEST(modified, clock_timestamp())
+                       WHERE id = ANY(film_work_ids);
+                       RETURN NULL;
+                   END;
+                   $$ LANGUAGE plpgsql;""",
+            reverse_sql='DROP FUNCTION IF EXISTS content.etl_touch_film_works();',
+        ),
+        *(
+            migrations.RunSQL(
+                sql=f'DROP TRIGGER IF EXISTS etl_enqueue_change ON content.{table};',
+                reverse_sql=f"""CREATE TRIGGER etl_enqueue_change
+                                AFTER INSERT OR UPDATE ON content.{table}
+                                FOR EACH ROW EXECUTE FUNCTION content.etl_enqueue_change();""",
+            )
+            for table in CONTENT_TABLES
+        ),
+        *(
+            migrations.RunSQL(
+                sql=f'DROP TRIGGER IF EXISTS etl_touch_film_work ON content.{table};',
+                reverse_sql=f"""CREATE TRIGGER etl_touch_film_work
+                                AFTER INSERT OR UPDATE OR DELETE ON content.{table}
+                                FOR EACH ROW EXECUTE FUNCTION content.etl_touch_film_work();""",
+            )
+            for table in RELATION_TABLES
+        ),
+        # Строчные функции из 0004 больше не нужны, при откате они создаются заново до своих триггеров.
+        migrations.RunSQL(
+            sql='DROP FUNCTION IF EXISTS content.etl_enqueue_change();',
+            reverse_sql="""CREATE OR REPLACE FUNCTION content.etl_enqueue_change() RETURNS trigger AS $$
+                           BEGIN
+                               INSERT INTO content.etl_change_queue (table_name, row_id) VALUES (TG_TABLE_NAME, NEW.id);
+                               PERFORM pg_notify('etl_changes', TG_TABLE_NAME);
+                               RETURN NULL;
+                           END;
+                           $$ LANGUAGE plpgsql;""",
+        ),
+        migrations.RunSQL(
+            sql='DROP FUNCTION IF EXISTS content.etl_touch_film_work();',
+            reverse_sql="""CREATE OR REPLACE FUNCTION content.etl_touch_film_work() RETURNS trigger AS $$
+                           BEGIN
+                               UPDATE content.film_work SET modified = now()
+                               WHERE id = CASE WHEN TG_OP = 'DELETE' THEN OLD.film_work_id ELSE NEW.film_work_id END;
+                               RETURN NULL;
+                           END;
+                           $$ LANGUAGE plpgsql;""",
+        ),
+        *(
+            migrations.RunSQL(
+                sql=f"""CREATE TRIGGER {name}
+                        AFTER {event} ON content.{table}
+                        REFERENCING {transition}
+                        FOR EACH STATEMENT EXECUTE FUNCTION content.etl_enqueue_changes();""",
+                reverse_sql=f'DROP TRIGGER IF EXISTS {name} ON content.{table};',
+            )
+            for table in CONTENT_TABLES
+            for name, (event, transition) in ENQUEUE_TRIGGERS.items()
+        ),
+        *(
+            migrations.RunSQL(
+                sql=f"""CREATE TRIGGER {name}
+                        AFTER {event} ON content.{table}
+                        REFERENCING {transition}
+                        FOR EACH STATEMENT EXECUTE FUNCTION content.etl_touch_film_works();""",
+                reverse_sql=f'DROP TRIGGER IF EXISTS {name} ON content.{table};',
+            )
+            for table in RELATION_TABLES
+            for name, (event, transition) in TOUCH_TRIGGERS.items()
+        ),
+    ]
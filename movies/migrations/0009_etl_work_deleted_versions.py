@@ -0,0 +1,17 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0008_etl_statement_triggers'),
+    ]
+
+    operations = [
+        # Версии удалений из etl_tombstone, в том же порядке, что и deleted.
+        migrations.RunSQL(
+            sql="""ALTER TABLE content.etl_work
+                   ADD COLUMN IF NOT EXISTS deleted_versions bigint[] NOT NULL DEFAULT '{}';""",
+            reverse_sql='ALTER TABLE content.etl_work DROP COLUMN IF EXISTS deleted_versions;',
+        ),
+    ]
@@ -32,6 +32,9 @@ class Genre(UUIDMixin, TimeStampedMixin):
         db_table = 'content\".\"genre'
         verbose_name = _('genre')
         verbose_name_plural = _('genres')
+        indexes = [
+            models.Index(fields=['modified', 'id'], name='genre_modified_id_idx')
+        ]
 
 
 class Person(UUIDMixin, TimeStampedMixin):
@@ -44,6 +47,9 @@ class Person(UUIDMixin, TimeStampedMixin):
         db_table = 'content\".\"person'
         verbose_name = _('person')
         verbose_name_plural = _('persons')
+        indexes = [
+            models.Index(fields=['modified', 'id'], name='person_modified_id_idx')
+        ]
 
 
 class Filmwork(UUIDMixin, TimeStampedMixin):
@@ -68,13 +74,15 @@ class Filmwork(UUIDMixin, TimeStampedMixin):
         verbose_name = _('film work')
         verbose_name_plural = _('film works')
         indexes = [
-            models.Index(fields=['creation_date'], name='film_work_creation_date_idx')
+            models.Index(fields=['creation_date'], name='film_work_creation_date_idx'),
+            models.Index(fields=['modified', 'id'], name='film_work_modified_id_idx'),
         ]
 
 
 class GenreFilmwork(UUIDMixin):
     film_work = models.ForeignKey(Filmwork, on_delete=models.CASCADE)
-    genre = models.ForeignKey(Genre, on_delete=models.CASCADE)
+    # индекс genre_film_work_genre_fw_idx начинается с genre_id
+    genre = models.ForeignKey(Genre, on_delete=models.CASCADE, db_index=False)
     created = models.DateField(auto_now_add=True)
 
     class Meta:
@@ -84,6 +92,9 @@ class GenreFilmwork(UUIDMixin):
         constraints = [
             models.UniqueConstraint(fields=['film_work', 'genre'], name='film_work_genre_idx'),
         ]
+        indexes = [
+            models.Index(fields=['genre', 'film_work'], name='genre_film_work_genre_fw_idx'),
+        ]
 
 
 class PersonFilmwork(UUIDMixin):
@@ -93,7 +104,8 @@ class PersonFilmwork(UUIDMixin):
         writer = 'writer', _('writer')
 
     film_work = models.ForeignKey(Filmwork, on_delete=models.CASCADE)
-    person = models.ForeignKey(Person, on_delete=models.CASCADE)
+    # индекс person_film_work_person_fw_idx начинается с person_id
+    person = models.ForeignKey(Person, on_delete=models.CASCADE, db_index=False)
     role = models.CharField(_('role'), choices=Role.choices, null=True, max_length=255)
     created = models.DateField(auto_now_add=True)
 
@@ -104,3 +116,6 @@ class PersonFilmwork(UUIDMixin):
         constraints = [
             models.UniqueConstraint(fields=['film_work', 'person', 'role'], name='film_work_person_idx'),
         ]
+        indexes = [
+            models.Index(fields=['person', 'film_work'], name='person_film_work_person_fw_idx'),
+        ]
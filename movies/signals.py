@@ -0,0 +1,24 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import bump_version
+from .models import Filmwork, Genre, GenreFilmwork, Person, PersonFilmwork
+
+CATALOG_MODELS = (Filmwork, Genre, Person, GenreFilmwork, PersonFilmwork)
+
+
+def invalidate_on_change(sender, **kwargs):
+    bump_version()
+
+
+# Обработчики только для моделей каталога, сохранение сессий и журнала админки кэш не трогает.
+for model in CATALOG_MODELS:
+    post_save.connect(invalidate_on_change, sender=model, dispatch_uid=f'invalidate_on_save_{model.__name__}')
+    post_delete.connect(invalidate_on_change, sender=model, dispatch_uid=f'invalidate_on_delete_{model.__name__}')
+
+
+@receiver(m2m_changed, sender=Filmwork.genres.through)
+@receiver(m2m_changed, sender=Filmwork.persons.through)
+def invalidate_on_relation_change(sender, action, **kwargs):
+    if action.startswith('post_'):
+        bump_version()
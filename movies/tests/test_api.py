@@ -0,0 +1,115 @@
+from django.core.cache import cache
+from django.test import TestCase
+
+from movies.models import Filmwork, Genre, GenreFilmwork, Person, PersonFilmwork
+
+
+class FilmworkQueriesTest(TestCase):
+    """Число запросов не зависит от числа кинопроизведений, жанров и персон."""
+
+    @classmethod
+    def setUpTestData(cls):
+        genres = [Genre.objects.create(name=f'Genre {number}') for number in range(3)]
+        persons = [Person.objects.create(full_name=f'Person {number}') for number in range(5)]
+        cls.film_works = []
+        for number in range(10):
+            film_work = Filmwork.objects.create(
+                title=f'Film {number}', creation_date='2000-01-01', rating=number, type='movie',
+            )
+            for genre in genres:
+                GenreFilmwork.objects.create(film_work=film_work, genre=genre)
+            for person, role in zip(persons, ['director', 'actor', 'actor', 'writer', 'writer']):
+                PersonFilmwork.objects.create(film_work=film_work, person=person, role=role)
+            cls.film_works.append(film_work)
+
+    def setUp(self):
+        # закэшированные ответы отдаются без запросов к базе
+        cache.clear()
+
+    def test_list_queries(self):
+        # COUNT(*) для страницы, кинопроизведения с ролями, жанры
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/v1/movies/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], len(self.film_works))
+        self.assertEqual(len(response.json()['results'][0]['actors']), 2)
+
+    def test_detail_queries(self):
+        # кинопроизведение с ролями, жанры
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/v1/movies/{self.film_works[0].id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['directors'], ['Person 0'])
+        self.assertEqual(len(response.json()['genres']), 3)
+
+
+class FilmworkCacheTest(TestCase):
+    """Валидаторы и закэшированные ответы меняются при любом изменении каталога."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.genre = Genre.objects.create(name='Drama')
+        cls.person = Person.objects.create(full_name='Director')
+        cls.film_work = Filmwork.objects.create(
+            title='Film', creation_date='2000-01-01', rating=5, type='movie',
+        )
+        GenreFilmwork.objects.create(film_work=cls.film_work, genre=cls.genre)
+        PersonFilmwork.objects.create(film_work=cls.film_work, person=cls.person, role='director')
+        cls.url = f'/api/v1/movies/{cls.film_work.id}/'
+
+    def setUp(self):
+        cache.clear()
+
+    def test_if_none_match(self):
+        response = self.client.get('/api/v1/movies/')
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get('/api/v1/movies/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_if_modified_since(self):
+        response = self.client.get('/api/v1/movies/')
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get('/api/v1/movies/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def assert_invalidated(self, change) -> dict:
+        """Применяет изменение и возвращает ответ, который пришел вместо 304 и закэшированного тела."""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        change()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        return response.json()
+
+    def test_film_work_saved(self):
+        def change():
+            self.film_work.title = 'Renamed film'
+            self.film_work.save()
+
+        self.assertEqual(self.assert_invalidated(change)['title'], 'Renamed film')
+
+    def test_genre_saved(self):
+        def change():
+            self.genre.name = 'Comedy'
+            self.genre.save()
+
+        self.assertEqual(self.assert_invalidated(change)['genres'], [{'name': 'Comedy'}])
+
+    def test_person_saved(self):
+        def change():
+            self.person.full_name = 'Renamed director'
+            self.person.save()
+
+        self.assertEqual(self.assert_invalidated(change)['directors'], ['Renamed director'])
+
+    def test_relation_changed(self):
+        def change():
+            self.film_work.genres.remove(self.genre)
+
+        self.assertEqual(self.assert_invalidated(change)['genres'], [])